@@ -0,0 +1,198 @@
+import argparse
+import os
+import re
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import planet_main as pm
+import planet_support as ps
+import planet_types as pt
+import planet_cache as pc
+import planet_raster as pr
+import planet_gif as pg
+import planet_profile as prof
+
+#The planet types that can be generated, by the name used on the command line
+planet_types = {'earth': pt.EarthAnalog,
+                'iron': pt.IronPlanet,
+                'ice': pt.IcePlanet}
+
+#The stages every planet goes through, in order
+stages = ('mesh', 'generate', 'render', 'encode')
+
+
+def render_planet(seed, planet_type, complexity, output_directory, animate=False, frames=360,
+                  canvas_size=(750, 750), diameter=500, fps=60, profile=False, rasterizer='auto'):
+    ''' Generates one planet and saves it as a still image or an animation, timing
+        each stage.
+
+        Parameters:
+            seed (str) : The seed of the planet.
+            planet_type (str) : The name of the planet type (a key of planet_types).
+            complexity (int) : How far the planet is subdivided.
+            output_directory (str) : The directory the image is saved in.
+            animate (boolean) : Whether a full rotation is saved (True) or a single image.
+            frames (int) : The number of frames in the rotation.
+            canvas_size (tuple<int, int>) : The dimensions of the image.
+            diameter (int) : The diameter of the planet.
+            fps (int) : The frames per second of the animation.
+            profile (boolean) : Whether the pipeline stages are recorded (see planet_profile).
+            rasterizer (str) : The rasterizer of the GifCanvas ('pil' or 'numpy'), or 'auto'
+                               for the faster one at this complexity (see pr.choose_rasterizer).
+
+        Returns:
+            filepath (str) : Where the image was saved.
+            timings (dict<str, float>) : The seconds spent in each stage.
+            report (dict<str, dict>) : The planet_profile report of this planet (None
+                                       unless profiling).
+
+    '''
+    timings = {}
+    if profile:
+        if not prof.is_enabled():
+            prof.enable()
+        prof.reset()
+
+    #The mesh is kept in each worker's mesh cache, so this only takes time
+    #for the first planet of each complexity a worker generates
+    start = time.perf_counter()
+    pc.get_base_mesh(complexity)
+    timings['mesh'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    planet = pm.PlanetObject(planet_types[planet_type](diameter, seed), complexity)
+    timings['generate'] = time.perf_counter() - start
+
+    #The stars are seeded from the planet so that reruns give the same image
+    star_seed = int(pc.get_field_key(planet_type, seed)[:16], 16)
+    if rasterizer == 'auto':
+        rasterizer = pr.choose_rasterizer(complexity)
+    gifcanvas = pm.GifCanvas(canvas_size, (0, 0, 0, 255), rasterizer=rasterizer, star_seed=star_seed)
+    gifcanvas.add_body(planet, 'centre')
+    gifcanvas.set_lighting([-1, 0, 1])
+
+    name = re.sub(r'[^\w.-]', '_', '{}_{}'.format(planet_type, seed))
+    filepath = os.path.join(output_directory, name + '.gif')
+    timings['render'] = 0
+    timings['encode'] = 0
+    if animate:
+        with pg.get_writer(filepath, fps, gifcanvas.get_palette()) as writer:
+            frame_iterator = gifcanvas.render_frames(frames)
+            for i in range(frames):
+                start = time.perf_counter()
+                image, stats = next(frame_iterator)
+                timings['render'] += time.perf_counter() - start
+
+                start = time.perf_counter()
+                with prof.stage('encoding'):
+                    writer.append_data(image)
+                timings['encode'] += time.perf_counter() - start
+    else:
+        start = time.perf_counter()
+        image = gifcanvas.draw_image()
+        timings['render'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with prof.stage('encoding'):
+            image.save(filepath, 'GIF')
+        timings['encode'] = time.perf_counter() - start
+
+    return filepath, timings, prof.get_report() if profile else None
+
+def _init_worker(complexity):
+    #The processes already use every core, so each one evaluates noise on one thread
+    ps.set_noise_threads(1)
+    #Build the mesh once per worker, before any planet is generated
+    pc.get_base_mesh(complexity)
+
+def run_batch(seeds, types, complexity, output_directory, workers=None, profile=None, **render_options):
+    ''' Generates and saves a planet for every seed and planet type, across a pool
+        of processes, and prints the throughput and the average time of each stage.
+
+        Parameters:
+            seeds (list<str>) : The seeds of the planets.
+            types (list<str>) : The names of the planet types (keys of planet_types).
+            complexity (int) : How far the planets are subdivided.
+            output_directory (str) : The directory the images are saved in.
+            workers (int) : The number of processes (the number of CPUs if None).
+            profile (str) : If given, the pipeline stages of every planet are recorded,
+                            printed as a table and saved as JSON to this path.
+            render_options : Extra arguments for render_planet (e.g. animate, frames).
+
+        Returns:
+            results (list<dict>) : The seed, type, file and stage timings of every planet.
+
+    '''
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    os.makedirs(output_directory, exist_ok=True)
+    jobs = [(seed, planet_type) for seed in seeds for planet_type in types]
+
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(complexity,)) as executor:
+        futures = {executor.submit(render_planet, seed, planet_type, complexity, output_directory,
+                                   profile=profile is not None, **render_options): (seed, planet_type)
+                   for seed, planet_type in jobs}
+        for future in as_completed(futures):
+            seed, planet_type = futures[future]
+            filepath, timings, report = future.result()
+            if report is not None:
+                prof.merge_report(report)
+            results.append({'seed': seed, 'type': planet_type, 'filepath': filepath, 'timings': timings})
+            print('Planet', len(results), 'of', len(jobs), 'saved to', filepath,
+                  '({:.2f}s)'.format(sum(timings.values())))
+    seconds = time.perf_counter() - start
+
+    print('{} planets in {:.2f}s ({:.2f} planets/sec with {} workers)'.format(len(results), seconds, len(results)/seconds, workers))
+    for stage in stages:
+        stage_seconds = [result['timings'][stage] for result in results]
+        print('  {:<9} mean {:.3f}s  max {:.3f}s'.format(stage, np.mean(stage_seconds), np.max(stage_seconds)))
+
+    if profile is not None:
+        print(prof.format_report())
+        prof.save_report(profile)
+    return results
+
+def get_parser():
+    ''' Returns the command line argument parser of the batch command.
+
+    '''
+    parser = argparse.ArgumentParser(description='Generate and render many planets at once.')
+    parser.add_argument('--seeds', nargs='+', default=[], help='The seeds of the planets.')
+    parser.add_argument('--seed-range', nargs=2, type=int, metavar=('START', 'STOP'),
+                        help='Also use the integers from START up to (not including) STOP as seeds.')
+    parser.add_argument('--types', nargs='+', default=['earth'], choices=sorted(planet_types),
+                        help='The planet types generated for each seed.')
+    parser.add_argument('--complexity', type=int, default=5, help='How far the planets are subdivided.')
+    parser.add_argument('--output', default='planets', help='The directory the images are saved in.')
+    parser.add_argument('--workers', type=int, default=None, help='The number of processes (default: one per CPU).')
+    parser.add_argument('--animate', action='store_true', help='Save a full rotation instead of a single image.')
+    parser.add_argument('--frames', type=int, default=360, help='The number of frames in a rotation.')
+    parser.add_argument('--size', nargs=2, type=int, default=[750, 750], metavar=('WIDTH', 'HEIGHT'),
+                        help='The dimensions of the images.')
+    parser.add_argument('--diameter', type=int, default=500, help='The diameter of the planets.')
+    parser.add_argument('--rasterizer', default='auto', choices=('auto', 'pil', 'numpy'),
+                        help='How faces are drawn (auto picks the faster one for the complexity).')
+    parser.add_argument('--profile', nargs='?', const='profile.json', default=None, metavar='FILEPATH',
+                        help='Record the time and memory of each stage and save them as JSON.')
+    return parser
+
+def main(args=None):
+    parser = get_parser()
+    options = parser.parse_args(args)
+
+    seeds = list(options.seeds)
+    if options.seed_range is not None:
+        seeds += [str(seed) for seed in range(*options.seed_range)]
+    if not seeds:
+        parser.error('no seeds given (use --seeds or --seed-range)')
+
+    return run_batch(seeds, options.types, options.complexity, options.output, options.workers, options.profile,
+                     animate=options.animate, frames=options.frames,
+                     canvas_size=tuple(options.size), diameter=options.diameter, rasterizer=options.rasterizer)
+
+
+if __name__ == "__main__":
+    main()
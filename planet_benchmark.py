@@ -0,0 +1,409 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import planet_main as pm
+import planet_cache as pc
+import planet_raster as pr
+import planet_support as ps
+import planet_gif as pg
+import planet_types as pt
+
+
+def benchmark_complexify(levels=range(8), diameter=500, seed='benchmark'):
+    ''' Times the subdivision of the planet (and the full planet build) at each
+        complexity level, with and without shared edge midpoints, and prints the
+        node counts for each.
+
+        Parameters:
+            levels (iterable<int>) : The complexity levels to time.
+            diameter (int) : The diameter of the planet being subdivided.
+            seed (str) : The seed of the planet being subdivided.
+
+        Returns:
+            results (list<dict>) : The node count and times of each level and mode.
+
+    '''
+    planet = pm.PlanetObject.__new__(pm.PlanetObject)
+    planet._planet = pt.IronPlanet(diameter, seed)
+    planet._radius = diameter * 0.5
+
+    results = []
+    print('complexity  mode          nodes      faces     seconds   build')
+    for complexity in levels:
+        for shared_edges in (False, True):
+            start = time.perf_counter()
+            planet.define_base_nodes()
+            planet.define_base_faces()
+            planet.complexify(complexity, shared_edges)
+            seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            pm.PlanetObject(planet._planet, complexity, shared_edges)
+            build_seconds = time.perf_counter() - start
+
+            result = {'complexity': complexity,
+                      'mode': 'shared' if shared_edges else 'duplicated',
+                      'nodes': len(planet._vertices),
+                      'faces': len(planet._face_indices),
+                      'seconds': seconds,
+                      'build_seconds': build_seconds}
+            results.append(result)
+            print('{complexity:<11} {mode:<13} {nodes:<10} {faces:<9} {seconds:<9.4f} {build_seconds:.4f}'.format(**result))
+    return results
+
+def compare_rasterizers(complexity=5, canvas_size=(750, 750), diameter=500, seed='benchmark', tolerance=30):
+    ''' Draws the same planet with the 'pil' and 'numpy' rasterizers and compares
+        the two images pixel by pixel. Small differences are expected along face
+        edges, where the two backends decide differently which face owns a pixel.
+
+        Parameters:
+            complexity (int) : The complexity of the planet being drawn.
+            canvas_size (tuple<int, int>) : The dimensions of the images.
+            diameter (int) : The diameter of the planet being drawn.
+            seed (str) : The seed of the planet being drawn.
+            tolerance (int) : The largest channel difference not counted as a mismatch.
+
+        Returns:
+            result (dict) : The draw time of each backend, the fraction of pixels that
+                            differ at all and the fraction that differ by more than
+                            [tolerance].
+
+    '''
+    planet = pm.PlanetObject(pt.EarthAnalog(diameter, seed), complexity)
+    planet.set_spin(40)
+
+    images = {}
+    result = {'complexity': complexity}
+    for rasterizer in ('pil', 'numpy'):
+        gifcanvas = pm.GifCanvas(canvas_size, (0, 0, 0, 255), rasterizer=rasterizer, star_seed=ps.stable_hash(seed))
+        gifcanvas.add_body(planet, 'centre')
+        start = time.perf_counter()
+        images[rasterizer] = np.asarray(gifcanvas.draw_image()).astype(int)
+        result[rasterizer + '_seconds'] = time.perf_counter() - start
+
+    difference = np.abs(images['pil'] - images['numpy']).max(axis=2)
+    edges = get_edge_pixels(images['pil'])
+    result['differing'] = float((difference > 0).mean())
+    result['mismatched'] = float((difference > tolerance).mean())
+    result['interior_mismatched'] = float((difference[~edges] > tolerance).mean())
+    print('complexity {complexity}: pil {pil_seconds:.3f}s, numpy {numpy_seconds:.3f}s, '
+          '{differing:.2%} of pixels differ, {mismatched:.2%} by more than the tolerance '
+          '({interior_mismatched:.2%} away from face edges)'.format(**result))
+    return result
+
+
+def get_edge_pixels(image):
+    ''' Finds the pixels within 1 pixel of a face edge in an image drawn by a GifCanvas:
+        faces are flat shaded, so these are the pixels with a differently colored
+        neighbour (including diagonally).
+
+        Parameters:
+            image (array<array<array<int>>>) : An (H, W, 3) image.
+
+        Returns:
+            edges (array<array<boolean>>) : An (H, W) array, True at edge pixels.
+
+    '''
+    padded = np.pad(image, ((1, 1), (1, 1), (0, 0)), mode='edge')
+    height, width = image.shape[:2]
+    edges = np.zeros((height, width), dtype=bool)
+    for dy in range(3):
+        for dx in range(3):
+            edges |= (padded[dy:dy+height, dx:dx+width] != image).any(axis=2)
+    return edges
+
+
+def check_rasterizers(complexities=(3, 5), max_mismatched=0.002, tolerance=30, **options):
+    ''' Checks the 'numpy' rasterizer draws planets the same as the 'pil' one (see
+        compare_rasterizers). The two disagree along face edges, and those pixels grow with
+        the outline rather than the area of the canvas, so only the pixels away from face
+        edges are held to [max_mismatched]; those match on any canvas size.
+
+        The numpy rasterizer costs about as much as filling the planet's disk (around 0.1s
+        a frame for a 500 pixel planet) however few faces it has, so it is slower than pil
+        below complexity 6 (see planet_raster.choose_rasterizer).
+
+        Parameters:
+            complexities (iterable<int>) : The complexities of the planets being drawn.
+            max_mismatched (float) : The largest fraction of the pixels away from face edges
+                                     allowed to differ by more than [tolerance].
+            tolerance (int) : The largest channel difference not counted as a mismatch.
+            options : Extra arguments for compare_rasterizers (e.g. canvas_size).
+
+        Returns:
+            results (list<dict>) : The results of compare_rasterizers.
+
+    '''
+    results = []
+    for complexity in complexities:
+        result = compare_rasterizers(complexity, tolerance=tolerance, **options)
+        if result['interior_mismatched'] > max_mismatched:
+            raise AssertionError('The numpy rasterizer differs from pil on {:.2%} of the pixels away from face edges '
+                                 'at complexity {} (at most {:.2%} allowed)'.format(result['interior_mismatched'], complexity, max_mismatched))
+        results.append(result)
+    return results
+
+
+def benchmark_islands(island_counts=(1, 5, 10, 20, 35, 70), complexity=6, diameter=500, seed='benchmark', repeats=3):
+    ''' Times the island pass of the terrain noise (see planet_support.get_island_ratios)
+        for increasing numbers of islands, against the previous approach of looping
+        over the islands, and checks the two give the same result.
+
+        Parameters:
+            island_counts (iterable<int>) : The numbers of islands to time.
+            complexity (int) : The complexity of the planet the islands are placed on.
+            diameter (int) : The diameter of the planet.
+            seed (str) : The seed used to place the islands.
+            repeats (int) : How many times each pass is timed (the fastest is kept).
+
+        Returns:
+            results (list<dict>) : The node count and times of each island count.
+
+    '''
+    planet = pm.PlanetObject(pt.EarthAnalog(diameter, seed), complexity)
+    nodes = planet._vertices
+    rng = ps.get_generator(seed, 'benchmark_islands')
+
+    results = []
+    print('islands  nodes      vectorized  loop      speedup')
+    for island_count in island_counts:
+        centres = nodes[rng.integers(len(nodes), size=island_count)]
+        sizes = rng.uniform(0.1, 0.5, size=island_count)*diameter
+
+        vectorized_seconds, loop_seconds = float('inf'), float('inf')
+        for x in range(repeats):
+            start = time.perf_counter()
+            ratios = ps.get_island_ratios(nodes, centres, sizes)
+            vectorized_seconds = min(vectorized_seconds, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            loop_ratios = np.zeros(len(nodes))
+            for centre, size in zip(centres, sizes):
+                loop_ratios = np.maximum(loop_ratios, 1 - np.sqrt(((nodes - centre)**2).sum(axis=1))/size)
+            loop_seconds = min(loop_seconds, time.perf_counter() - start)
+
+        result = {'islands': island_count,
+                  'nodes': len(nodes),
+                  'seconds': vectorized_seconds,
+                  'loop_seconds': loop_seconds,
+                  'matches': bool(np.array_equal(ratios, loop_ratios))}
+        results.append(result)
+        print('{islands:<8} {nodes:<10} {seconds:<11.4f} {loop_seconds:<9.4f} {0:.1f}x'.format(
+              loop_seconds/max(vectorized_seconds, 1e-9), **result))
+    return results
+
+
+def benchmark_octaves(octave_counts=(1, 3, 6, 8), complexity=7, diameter=500, seed='benchmark', repeats=3):
+    ''' Times fractal noise (see planet_support.fbm_array) with increasing numbers of
+        octaves, against adding up one perlin_array pass per octave, and checks the
+        two give the same result.
+
+        Parameters:
+            octave_counts (iterable<int>) : The numbers of octaves to time.
+            complexity (int) : The complexity of the mesh the noise is evaluated on.
+            diameter (int) : The diameter of the planet.
+            seed (str) : The seed of the octave hashes.
+            repeats (int) : How many times each pass is timed (the fastest is kept).
+
+        Returns:
+            results (list<dict>) : The node count and times of each octave count.
+
+    '''
+    nodes = pc.get_base_mesh(complexity)[0]*diameter/2
+    hashes = [int(value) for value in ps.get_generator(seed, 'benchmark_octaves').integers(2**63, size=max(octave_counts))]
+
+    results = []
+    print('octaves  nodes      fused     separate  speedup')
+    for octave_count in octave_counts:
+        octaves = [(diameter/(4*2**i), 0.5**i) for i in range(octave_count)]
+
+        fused_seconds, separate_seconds = float('inf'), float('inf')
+        for x in range(repeats):
+            start = time.perf_counter()
+            noise = ps.fbm_array(nodes, octaves, 1, hashes[:octave_count])
+            fused_seconds = min(fused_seconds, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            separate_noise = 0
+            for (period, weight), random_hash in zip(octaves, hashes):
+                separate_noise = separate_noise + weight*ps.perlin_array(nodes, period, 1, random_hash)
+            separate_seconds = min(separate_seconds, time.perf_counter() - start)
+
+        result = {'octaves': octave_count,
+                  'nodes': len(nodes),
+                  'seconds': fused_seconds,
+                  'separate_seconds': separate_seconds,
+                  'matches': bool(np.array_equal(noise, separate_noise))}
+        results.append(result)
+        print('{octaves:<8} {nodes:<10} {seconds:<9.4f} {separate_seconds:<9.4f} {0:.1f}x'.format(
+              separate_seconds/max(fused_seconds, 1e-9), **result))
+    return results
+
+
+def benchmark_suite(types=('EarthAnalog', 'IronPlanet', 'IcePlanet'), levels=range(3, 8), seed='benchmark',
+                    frames=12, canvas_size=(750, 750), diameter=500, rasterizer='auto', repeats=3):
+    ''' Times the construction of a planet, the render of a single frame and the render
+        and encoding of a short animation, for each planet type and complexity. Every
+        planet and starfield is seeded, and the field cache is not used, so results can
+        be compared between runs (see compare_results).
+
+        Parameters:
+            types (iterable<str>) : The names of the planet type classes in planet_types.
+            levels (iterable<int>) : The complexity levels to time.
+            seed (str) : The seed of every planet.
+            frames (int) : The number of frames in the animation.
+            canvas_size (tuple<int, int>) : The dimensions of the images.
+            diameter (int) : The diameter of the planets.
+            rasterizer (str) : The rasterizer of the GifCanvas ('pil' or 'numpy'), or 'auto'
+                               for the faster one at each complexity (see pr.choose_rasterizer).
+            repeats (int) : How many times construction, single frames and the animation
+                            are timed (the fastest is kept).
+
+        Returns:
+            results (dict) : The settings of the run and, under 'results', the times (in
+                             seconds) and peak memory (in bytes) of each planet type
+                             and complexity, keyed '<type>/<complexity>'.
+
+    '''
+    field_directory = pc._field_directory
+    pc.set_field_directory(None)
+    results = {}
+    print('planet           complexity  construct  frame     animation  peak MiB')
+    try:
+        for type_name in types:
+            planet_type = getattr(pt, type_name)
+            for complexity in levels:
+                #Build once first so the mesh cache is warm for every timed build
+                pm.PlanetObject(planet_type(diameter, seed), complexity)
+                construct_seconds = float('inf')
+                for x in range(repeats):
+                    start = time.perf_counter()
+                    planet = pm.PlanetObject(planet_type(diameter, seed), complexity)
+                    construct_seconds = min(construct_seconds, time.perf_counter() - start)
+
+                level_rasterizer = pr.choose_rasterizer(complexity) if rasterizer == 'auto' else rasterizer
+                gifcanvas = pm.GifCanvas(canvas_size, (0, 0, 0, 255), rasterizer=level_rasterizer, star_seed=0)
+                gifcanvas.add_body(planet, 'centre')
+                gifcanvas.set_lighting([-1, 0, 1])
+                frame_seconds = float('inf')
+                for x in range(repeats):
+                    start = time.perf_counter()
+                    gifcanvas.draw_frame(0, frames)
+                    frame_seconds = min(frame_seconds, time.perf_counter() - start)
+
+                animation_seconds = float('inf')
+                with tempfile.TemporaryDirectory() as directory:
+                    for x in range(repeats):
+                        start = time.perf_counter()
+                        with pg.get_writer(os.path.join(directory, 'benchmark.gif'), palette=gifcanvas.get_palette()) as writer:
+                            for image, stats in gifcanvas.render_frames(frames):
+                                writer.append_data(image)
+                        animation_seconds = min(animation_seconds, time.perf_counter() - start)
+
+                #Memory is measured in a separate, untimed pass as tracing slows everything down
+                tracemalloc.start()
+                gifcanvas.remove_body(planet)
+                planet = pm.PlanetObject(planet_type(diameter, seed), complexity)
+                gifcanvas.add_body(planet, 'centre')
+                gifcanvas.draw_frame(0, frames)
+                peak_bytes = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                result = {'construct_seconds': construct_seconds,
+                          'frame_seconds': frame_seconds,
+                          'animation_seconds': animation_seconds,
+                          'peak_bytes': peak_bytes,
+                          'faces': len(planet._face_indices),
+                          'rasterizer': level_rasterizer}
+                results['{}/{}'.format(type_name, complexity)] = result
+                print('{0:<16} {1:<11} {construct_seconds:<10.4f} {frame_seconds:<9.4f} {animation_seconds:<10.4f} {2:.1f}'.format(
+                      type_name, complexity, peak_bytes/2**20, **result))
+    finally:
+        pc.set_field_directory(field_directory)
+
+    return {'seed': seed, 'frames': frames, 'canvas_size': list(canvas_size), 'rasterizer': rasterizer, 'results': results}
+
+def save_results(results, filepath):
+    ''' Saves the results of benchmark_suite as JSON.
+
+        Parameters:
+            results (dict) : The results of benchmark_suite.
+            filepath (str) : Where the results are saved.
+
+    '''
+    with open(filepath, 'w') as results_file:
+        json.dump(results, results_file, indent=4, sort_keys=True)
+
+def compare_results(results, baseline, threshold=0.2, min_seconds=0.005, min_bytes=2**20):
+    ''' Compares the results of benchmark_suite to a baseline (e.g. saved from an earlier
+        commit), and prints every time or memory that is more than [threshold] worse.
+        The times are the fastest of several runs, but millisecond times still vary
+        by more than any sensible threshold between runs, so a change is only counted
+        if it is also larger than [min_seconds] (or [min_bytes] for memory).
+
+        Parameters:
+            results (dict) : The results of benchmark_suite.
+            baseline (dict or str) : Earlier results, or the path of a file they were saved to.
+            threshold (float) : The largest allowed slowdown, as a fraction of the baseline.
+            min_seconds (float) : The largest slowdown in seconds ignored whatever its ratio.
+            min_bytes (int) : The largest increase in peak memory ignored whatever its ratio.
+
+        Returns:
+            regressions (list<dict>) : The planet, measure, baseline value, new value and
+                                       ratio of every regression.
+
+    '''
+    if isinstance(baseline, str):
+        with open(baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    regressions = []
+    for key, result in sorted(results['results'].items()):
+        previous = baseline['results'].get(key)
+        if previous is None:
+            continue
+        for measure in ('construct_seconds', 'frame_seconds', 'animation_seconds', 'peak_bytes'):
+            if measure not in previous or previous[measure] <= 0:
+                continue
+            floor = min_bytes if measure == 'peak_bytes' else min_seconds
+            ratio = result[measure]/previous[measure]
+            if ratio > 1 + threshold and result[measure] - previous[measure] > floor:
+                regressions.append({'planet': key, 'measure': measure, 'baseline': previous[measure],
+                                    'value': result[measure], 'ratio': ratio})
+                print('REGRESSION {:<16} {:<18} {:.4g} -> {:.4g} ({:+.0%})'.format(
+                      key, measure, previous[measure], result[measure], ratio - 1))
+    if not regressions:
+        print('No regressions above {:.0%}.'.format(threshold))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark planet generation and rendering.')
+    parser.add_argument('benchmark', nargs='?', default='complexify', choices=('complexify', 'islands', 'octaves', 'rasterizers', 'suite'))
+    parser.add_argument('--levels', nargs='+', type=int, default=None, help='The complexity levels to benchmark.')
+    parser.add_argument('--output', default=None, help='Where the suite results are saved as JSON.')
+    parser.add_argument('--baseline', default=None, help='Earlier suite results to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='The largest allowed slowdown (0.2 is 20%%).')
+    parser.add_argument('--min-seconds', type=float, default=0.005,
+                        help='Slowdowns smaller than this many seconds are never counted as regressions.')
+    options = parser.parse_args()
+
+    if options.benchmark == 'complexify':
+        benchmark_complexify(options.levels or range(8))
+    elif options.benchmark == 'islands':
+        benchmark_islands()
+    elif options.benchmark == 'octaves':
+        benchmark_octaves()
+    elif options.benchmark == 'rasterizers':
+        check_rasterizers(options.levels or [5])
+    else:
+        results = benchmark_suite(levels=options.levels or range(3, 8))
+        if options.output is not None:
+            save_results(results, options.output)
+        if options.baseline is not None:
+            if compare_results(results, options.baseline, options.threshold, options.min_seconds):
+                sys.exit(1)
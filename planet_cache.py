@@ -0,0 +1,159 @@
+import functools
+import hashlib
+import os
+import numpy as np
+import planet_support as ps
+
+#Directory in which base meshes are stored as .npz files between runs.
+#If None (or ATLAS_MESH_CACHE is set but empty), meshes are only cached in memory.
+_mesh_directory = os.environ.get('ATLAS_MESH_CACHE') or None
+
+#Directory in which generated fields (elevation, biome colors and clouds) are
+#stored as .npz files between runs, and the most bytes kept there before the
+#least recently used fields are removed. If None (or ATLAS_FIELD_CACHE is set but
+#empty), fields are not cached.
+_field_directory = os.environ.get('ATLAS_FIELD_CACHE') or None
+_field_cache_bytes = int(os.environ.get('ATLAS_FIELD_CACHE_BYTES', 256*2**20))
+
+
+def set_mesh_directory(directory):
+    ''' Sets the directory in which base meshes are stored between runs.
+
+        Parameters:
+            directory (str) : The directory to store meshes in, or None to only
+                              cache meshes in memory.
+
+    '''
+    global _mesh_directory
+    _mesh_directory = directory
+    _load_base_mesh.cache_clear()
+
+def get_base_mesh(complexity, shared_edges=True):
+    ''' Returns the nodes and faces of a unit sphere subdivided [complexity] times.
+        Meshes are kept in an in-process LRU cache and, if a mesh directory is set,
+        in a .npz file per complexity, so the subdivision is only done once.
+        The returned arrays are shared and read-only; scale the nodes to get a copy.
+
+        Parameters:
+            complexity (int) : How far the icosahedron is subdivided.
+            shared_edges (boolean) : Whether faces sharing an edge also share its midpoint.
+
+        Returns:
+            nodes (array<array<float, float, float>>) : An (N, 3) array of unit nodes.
+            faces (array<array<int, int, int>>) : An (F, 3) array of node indexes.
+
+    '''
+    return _load_base_mesh(int(complexity), bool(shared_edges), _mesh_directory)
+
+@functools.lru_cache(maxsize=8)
+def _load_base_mesh(complexity, shared_edges, directory):
+    filepath = None
+    if directory is not None:
+        mode = 'shared' if shared_edges else 'duplicated'
+        filepath = os.path.join(directory, 'mesh_{}_{}.npz'.format(complexity, mode))
+
+    if filepath is not None and os.path.exists(filepath):
+        with np.load(filepath) as mesh:
+            nodes, faces = mesh['nodes'], mesh['faces']
+    else:
+        nodes, faces = ps.get_icosahedron_nodes(), ps.get_icosahedron_faces()
+        for x in range(complexity):
+            nodes, faces = ps.subdivide(nodes, faces, 1, shared_edges)
+
+        if filepath is not None:
+            #Write to a temporary file first so that other processes never
+            #load a half written mesh.
+            os.makedirs(directory, exist_ok=True)
+            temppath = '{}.{}.tmp.npz'.format(filepath[:-4], os.getpid())
+            np.savez(temppath, nodes=nodes, faces=faces)
+            os.replace(temppath, filepath)
+
+    nodes.flags.writeable = False
+    faces.flags.writeable = False
+    return nodes, faces
+
+def set_field_directory(directory, max_bytes=None):
+    ''' Sets the directory in which generated fields are stored between runs.
+
+        Parameters:
+            directory (str) : The directory to store fields in, or None to not
+                              cache fields.
+            max_bytes (int) : The most bytes of fields kept in the directory (unchanged if None).
+
+    '''
+    global _field_directory, _field_cache_bytes
+    _field_directory = directory
+    if max_bytes is not None:
+        _field_cache_bytes = int(max_bytes)
+
+def get_field_key(*values):
+    ''' Returns a key naming the fields generated from the given values (e.g. the
+        planet class, seed, diameter and complexity). The key is the same in every
+        process and every run, unlike hash().
+
+        Returns:
+            key (str) : A hex digest of the values.
+
+    '''
+    return hashlib.sha1(repr(values).encode('utf-8')).hexdigest()
+
+def load_fields(key):
+    ''' Loads the fields stored under a key, marking them as recently used.
+
+        Parameters:
+            key (str) : The key from get_field_key.
+
+        Returns:
+            fields (dict<str, array>) : The stored arrays, or None if there are none.
+
+    '''
+    if _field_directory is None:
+        return None
+    filepath = os.path.join(_field_directory, 'fields_{}.npz'.format(key))
+    try:
+        with np.load(filepath) as stored:
+            fields = {name: stored[name] for name in stored.files}
+        os.utime(filepath)
+    except (OSError, ValueError):
+        #Missing, or removed or being replaced by another process
+        return None
+    return fields
+
+def save_fields(key, **fields):
+    ''' Stores arrays under a key, then removes the least recently used fields
+        until the directory is within its size limit.
+
+        Parameters:
+            key (str) : The key from get_field_key.
+            fields (array) : The arrays to store, by name.
+
+    '''
+    if _field_directory is None:
+        return
+    os.makedirs(_field_directory, exist_ok=True)
+    filepath = os.path.join(_field_directory, 'fields_{}.npz'.format(key))
+    temppath = '{}.{}.tmp.npz'.format(filepath[:-4], os.getpid())
+    np.savez_compressed(temppath, **fields)
+    os.replace(temppath, filepath)
+    _evict_fields(_field_directory, _field_cache_bytes)
+
+def _evict_fields(directory, max_bytes):
+    #Fields are used in order of modification time, which load_fields updates
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.startswith('fields_') and not entry.name.endswith('.tmp.npz'):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for mtime, size, path in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
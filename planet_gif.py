@@ -0,0 +1,227 @@
+import os
+import struct
+import numpy as np
+import imageio
+from PIL import Image, GifImagePlugin
+
+
+class GifWriter(object):
+    '''GifWriter writes an animated .gif one frame at a time, so frames never have to
+       be held in memory until the end. It has the same append_data/close interface as
+       an imageio writer, and can be used as a context manager.
+
+       Without a palette, each frame is quantized to its own adaptive palette (as
+       imageio and PIL do when saving RGB frames) and written with a local color table.
+
+       With a palette, every frame is mapped onto that one global palette through a
+       lookup table, and only the rectangle that changed since the previous frame is
+       written (the rest of the previous frame is kept on screen).
+
+    '''
+
+    def __init__(self, filepath, fps=60, loop=0, palette=None):
+        ''' Opens the .gif for writing.
+
+            Parameters:
+                filepath (str) : Where the gif will be saved.
+                fps (int) : The desired frames per second of the gif.
+                loop (int) : How many times the gif loops (0 loops forever).
+                palette (array<array<int, int, int>>) : Up to 256 RGB colors used for
+                                                        every frame (see build_palette).
+
+        '''
+        self._filepath = filepath
+        self._file = open(filepath, 'wb')
+        self._duration = 1000/fps
+        self._loop = loop
+        self._size = None
+        self._palette = None
+        self._previous = None
+        if palette is not None:
+            self._palette = np.asarray(palette, dtype=np.uint8).reshape(-1, 3)
+            self._lookup = get_palette_lookup(self._palette)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def append_data(self, frame):
+        ''' Encodes a frame and writes it to the gif.
+
+            Parameters:
+                frame (array<array<array<int>>>) : An (H, W, 3) uint8 array.
+
+        '''
+        frame = np.asarray(frame)
+        if self._size is None:
+            self._size = (frame.shape[1], frame.shape[0])
+            if self._palette is None:
+                self.write_header()
+            else:
+                self.write_header(self._palette.tobytes())
+
+        if self._palette is None:
+            image = Image.fromarray(frame[:, :, :3]).convert('P', palette=Image.Palette.ADAPTIVE)
+            self.write_frame(image, (0, 0), include_color_table=True)
+            return
+
+        indexes = map_to_palette(frame, self._lookup)
+
+        #Only the bounding box of the pixels that changed is written
+        left, top, right, bottom = 0, 0, self._size[0], self._size[1]
+        if self._previous is not None:
+            changed = indexes != self._previous
+            rows, columns = np.flatnonzero(changed.any(axis=1)), np.flatnonzero(changed.any(axis=0))
+            if len(rows) == 0:
+                #Nothing changed, but the frame still needs writing to keep its timing
+                left, top, right, bottom = 0, 0, 1, 1
+            else:
+                left, top, right, bottom = columns[0], rows[0], columns[-1] + 1, rows[-1] + 1
+        self._previous = indexes
+
+        image = Image.fromarray(np.ascontiguousarray(indexes[top:bottom, left:right]), 'P')
+        image.putpalette(self._palette.tobytes())
+        self.write_frame(image, (int(left), int(top)), disposal=1)
+
+    def write_header(self, palette=b'\x00\x00\x00\xff\xff\xff'):
+        ''' Writes the gif header, the global color table and the looping extension.
+
+            Parameters:
+                palette (bytes) : The global color table as RGB triplets.
+
+        '''
+        #The color table holds a power of two (at least 2) number of colors
+        table_bits = max(1, (len(palette)//3 - 1).bit_length())
+        palette = palette + b'\x00'*(3*2**table_bits - len(palette))
+
+        width, height = self._size
+        self._file.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0x80 | (table_bits - 1), 0, 0))
+        self._file.write(palette)
+        self._file.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', self._loop) + b'\x00')
+
+    def write_frame(self, image, offset, **params):
+        ''' Writes a palette image as a frame of the gif.
+
+            Parameters:
+                image (Image) : The frame (or the changed part of it) in 'P' mode.
+                offset (tuple<int, int>) : Where the top left of the image is drawn.
+                params : Extra gif encoder settings (e.g. include_color_table, disposal).
+
+        '''
+        for data in GifImagePlugin.getdata(image, offset, duration=self._duration, **params):
+            self._file.write(data)
+
+    def close(self):
+        ''' Finishes the gif and closes the file. A gif needs at least one frame, so if
+            no frames were written the file is removed rather than left invalid.
+
+        '''
+        if not self._file.closed:
+            if self._size is None:
+                self._file.close()
+                os.remove(self._filepath)
+            else:
+                self._file.write(b';')
+                self._file.close()
+
+
+def build_palette(colors, size=256, reserved=None):
+    ''' Builds a palette of at most [size] colors out of the colors an animation uses.
+        Reserved colors (e.g. the static background and stars) are always kept exactly,
+        and the other colors fill the remaining entries. If there are more of them than
+        that, they are reduced with PIL's maximum coverage quantizer.
+
+        Parameters:
+            colors (array<array<int>>) : An (N, 3+) array of the colors being used.
+            size (int) : The largest number of colors in the palette.
+            reserved (array<array<int>>) : An (R, 3+) array of colors that are kept as
+                                           they are (at most [size] distinct colors).
+
+        Returns:
+            palette (array<array<int, int, int>>) : A (K, 3) uint8 array of colors, with
+                                                    the reserved colors first.
+
+    '''
+    colors = _unique_colors(colors)
+    reserved = _unique_colors(np.zeros((0, 3)) if reserved is None else reserved)
+    if len(reserved) > size:
+        raise ValueError('{} reserved colors do not fit in a palette of {}'.format(len(reserved), size))
+
+    #Colors that are already reserved do not need an entry of their own
+    packed = lambda rgb: (rgb[:, 0].astype(np.uint32) << 16) | (rgb[:, 1].astype(np.uint32) << 8) | rgb[:, 2]
+    colors = colors[~np.isin(packed(colors), packed(reserved))]
+
+    free = size - len(reserved)
+    if len(colors) > free:
+        if free == 0:
+            colors = colors[:0]
+        else:
+            image = Image.fromarray(colors[None, :, :]).quantize(free, method=Image.Quantize.MAXCOVERAGE)
+            colors = np.asarray(image.getpalette()[:3*free], dtype=np.uint8).reshape(-1, 3)
+    return np.concatenate((reserved, colors))
+
+def _unique_colors(colors):
+    colors = np.asarray(colors, dtype=np.uint8)
+    return np.unique(colors.reshape(-1, np.shape(colors)[-1])[:, :3], axis=0)
+
+def get_palette_lookup(palette, bits=6):
+    ''' Builds a table mapping every color (with [bits] bits per channel) to the index
+        of the closest color in the palette.
+
+        Parameters:
+            palette (array<array<int, int, int>>) : Up to 256 RGB colors.
+            bits (int) : The precision of the table in bits per channel.
+
+        Returns:
+            lookup (array<int>) : A uint8 array of 2^(3*bits) palette indexes.
+
+    '''
+    levels = (np.arange(2**bits) << (8 - bits)) + (1 << (7 - bits))
+    red, green, blue = np.meshgrid(levels, levels, levels, indexing='ij')
+    grid = np.stack((red, green, blue), axis=-1).reshape(2**(3*bits//2), -1, 3).astype(np.uint8)
+
+    #Unused palette entries repeat the first color so they are never chosen over it
+    palette = np.asarray(palette, dtype=np.uint8).reshape(-1, 3)
+    padded = np.concatenate((palette, np.repeat(palette[:1], 256 - len(palette), axis=0)))
+    palette_image = Image.new('P', (1, 1))
+    palette_image.putpalette(padded.tobytes())
+
+    lookup = np.asarray(Image.fromarray(grid).quantize(palette=palette_image, dither=Image.Dither.NONE))
+    lookup = lookup.reshape(-1).astype(np.uint8)
+    lookup.flags.writeable = False
+    return lookup
+
+def map_to_palette(frame, lookup, bits=6):
+    ''' Maps a frame onto palette indexes using a table from get_palette_lookup.
+
+        Parameters:
+            frame (array<array<array<int>>>) : An (H, W, 3+) uint8 array.
+            lookup (array<int>) : The table from get_palette_lookup.
+            bits (int) : The precision of the table in bits per channel.
+
+        Returns:
+            indexes (array<array<int>>) : An (H, W) uint8 array of palette indexes.
+
+    '''
+    frame = np.asarray(frame, dtype=np.uint8)
+    shift = 8 - bits
+    red = (frame[:, :, 0] >> shift).astype(np.intp)
+    green = (frame[:, :, 1] >> shift).astype(np.intp)
+    blue = (frame[:, :, 2] >> shift).astype(np.intp)
+    return lookup[(red << (2*bits)) | (green << bits) | blue]
+
+def get_writer(filepath, fps=60, palette=None):
+    ''' Returns a writer that encodes frames as they are appended: a GifWriter for
+        .gif files, and an imageio writer (e.g. ffmpeg for .mp4) otherwise.
+
+        Parameters:
+            filepath (str) : Where the animation will be saved.
+            fps (int) : The desired frames per second.
+            palette (array<array<int, int, int>>) : A global palette for .gif files.
+
+    '''
+    if filepath.lower().endswith('.gif'):
+        return GifWriter(filepath, fps, palette=palette)
+    return imageio.get_writer(filepath, fps=fps)
@@ -1,10 +1,18 @@
 from PIL import ImageDraw, Image, ImageFont
 import numpy as np
 import imageio
-import math, random
+import random
 import time, datetime
+import collections
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import planet_support as ps
 import planet_types as pt
+import planet_cache as pc
+import planet_raster as pr
+import planet_gif as pg
+import planet_profile as prof
 
 class PlanetObject(object):
     '''Planet is an object representing a planet with basic methods for:
@@ -17,27 +25,160 @@ class PlanetObject(object):
         - Generating terrain
         - Generating clouds (if applicable for that planet type)
 
+        The mesh is stored in compact arrays:
+            - _vertices (float64 array of shape (N, 3)) : The position of every node.
+            - _face_indices (int32 array of shape (F, 3)) : The nodes making up every face.
+            - _face_colors (uint8 array of shape (F, 4)) : The biome color of every face.
+            - _cloud_indices, _cloud_colors : The same for the cloud faces.
+            - _cloud_vertices (float64 array of shape (N, 3)) : The cloud shell, a node
+              at the cloud height above every node.
+        The older list representations are still available through get_nodes,
+        get_faces and get_cloud_faces (or _nodes, _faces and _cloud_faces).
+
+        Everything but the mesh is generated in layers, each of which is only generated
+        the first time it is needed (see require):
+            - rotation : The axis of rotation (define_rotation).
+            - terrain : The height of every node (gen_terrain).
+            - biomes : The biome color of every face (assign_biomes).
+            - clouds : The cloud faces (gen_clouds).
+
     '''
 
-    def __init__(self, planet, complexity):
+    #The layers a planet is generated in, and the layers each one is generated from
+    layers = ('rotation', 'terrain', 'biomes', 'clouds')
+    _layer_requirements = {'rotation': (),
+                           'terrain': ('rotation',),
+                           'biomes': ('terrain',),
+                           'clouds': ('terrain',)}
+
+    #The layers stored in the field cache (see load_fields)
+    _field_layers = ('terrain', 'biomes', 'clouds')
+
+    #Part of the field cache key, raised whenever the same seed generates different fields
+    _field_version = 2
+
+    def __init__(self, planet, complexity, shared_edges=True, layers=None):
         ''' Initializes the planet
 
             Parameters:
                 planet_type (PlanetType) : The information class holding the planet's characteristic info
                 complexity (int) : An int representing how smooth/complex the planet should be.
+                shared_edges (boolean) : Whether faces sharing an edge also share its midpoint
+                                         when subdividing (see complexify).
+                layers (iterable<str>) : The layers generated straight away (every layer if None).
+                                         The others are generated when they are first needed.
                 
         '''
         self._planet = planet
         self._radius = self._planet.get_diameter() * 0.5
         self._attr = self._planet.get_attributes()
-        self.define_base_nodes()
-        self.define_base_faces()
-        self.complexify(complexity)
-        self.define_rotation() 
-        self.gen_terrain()
-        self.assign_biomes()
-        self.gen_clouds()
+        self._base_vertices = None
+        self._base_cloud_vertices = None
+        self._cloud_speed = 1
+        self._layers = set()
+        self._fields_checked = False
+        self.define_mesh(complexity, shared_edges)
+        self.require(*(self.layers if layers is None else layers))
+
+    def require(self, *layers):
+        ''' Generates the given layers, and the layers they are generated from, unless
+            they have been generated already. Terrain, biomes and clouds are loaded
+            from the field cache instead if they are there.
+
+            Parameters:
+                layers (str) : The names of the layers (see PlanetObject.layers).
+
+        '''
+        for layer in layers:
+            if layer in self._layers:
+                continue
+            if layer not in self._layer_requirements:
+                raise ValueError('Unknown layer: {}'.format(layer))
+            self.require(*self._layer_requirements[layer])
+
+            if layer in self._field_layers and not self._fields_checked:
+                self._fields_checked = True
+                if self.load_fields():
+                    self._layers.update(self._field_layers)
+                    continue
+
+            #Every layer draws from its own stream of the planet (see BodySetting.get_generator),
+            #so the planet is the same whenever (and in whichever order) they are generated
+            if layer == 'rotation':
+                self.define_rotation()
+            elif layer == 'terrain':
+                self.gen_terrain()
+            elif layer == 'biomes':
+                self.assign_biomes()
+            else:
+                self.gen_clouds()
+            self._layers.add(layer)
+
+            if layer in self._field_layers and self._layers.issuperset(self._field_layers):
+                self.save_fields()
+
+    def has_layer(self, layer):
+        ''' Returns whether a layer has been generated (or loaded).
+
+            Parameters:
+                layer (str) : The name of the layer.
+
+        '''
+        return layer in self._layers
+
+    def get_nodes(self):
+        ''' Returns the nodes of the planet as a list of [x, y, z] lists.
+
+        '''
+        return self._vertices.tolist()
+
+    def get_faces(self):
+        ''' Returns the faces of the planet as a list of [node1, node2, node3, color]
+            lists (the color is only present once biomes have been assigned).
+
+        '''
+        faces = self._face_indices.tolist()
+        if getattr(self, '_face_colors', None) is not None:
+            for face, color in zip(faces, self._face_colors.tolist()):
+                face.append(tuple(color))
+        return faces
+
+    def get_cloud_faces(self):
+        ''' Returns the cloud faces of the planet as a list of [node1, node2, node3, color]
+            lists.
+
+        '''
+        self.require('clouds')
+        return [face + [tuple(color)] for face, color in zip(self._cloud_indices.tolist(), self._cloud_colors.tolist())]
 
+    _nodes = property(get_nodes)
+    _faces = property(get_faces)
+    _cloud_faces = property(get_cloud_faces)
+
+    def get_vertex_array(self):
+        return self._vertices
+
+    def get_face_array(self):
+        return self._face_indices
+
+    def get_color_array(self):
+        self.require('biomes')
+        return self._face_colors
+
+    def get_elevation(self):
+        ''' Returns the height of every node above the planet's radius, as a fraction
+            of the radius.
+
+        '''
+        self.require('terrain')
+        return self._elevation
+
+    def get_cloud_mask(self):
+        ''' Returns whether each face is covered by cloud.
+
+        '''
+        self.require('clouds')
+        return self._clouds
 
     def define_rotation(self):
         ''' Initializes the axis of rotation for the planet. The axis is mapped using the
@@ -45,10 +186,11 @@ class PlanetObject(object):
             anti-clockwise from above (1).
                 
         '''
+        generator = self._planet.get_generator('rotation')
         spin_options = [-1, 1]
-        self._axis_spin = random.choice(spin_options)
-        self._axis_elevation_angle = random.randrange(-90, 90)
-        self._axis_azimuth_angle = random.randrange(-180, 180)
+        self._axis_spin = spin_options[int(generator.integers(len(spin_options)))]
+        self._axis_elevation_angle = int(generator.integers(-90, 90))
+        self._axis_azimuth_angle = int(generator.integers(-180, 180))
         self.set_axis()
 
     def spin(self, speed):
@@ -60,33 +202,21 @@ class PlanetObject(object):
                 speed (float) : The speed at which the planet is rotated
                 
         '''
-        cosTheta1 = math.cos(math.radians(self._axis_azimuth_angle))
-        sinTheta1 = -math.sin(math.radians(self._axis_azimuth_angle))
-        cosTheta2 = math.cos(math.radians(self._axis_elevation_angle))
-        sinTheta2 = -math.sin(math.radians(self._axis_elevation_angle))
-        cosTheta3 = math.cos(math.radians(speed*self._axis_spin))
-        sinTheta3 = math.sin(math.radians(speed*self._axis_spin))
-        for node in self._nodes:
-            x = node[0]
-            z = node[2]
-            node[0] = cosTheta1 * x - sinTheta1 * z
-            node[2] = sinTheta1 * x + cosTheta1 * z
-            x = node[0]
-            y = node[1]
-            node[0] = cosTheta2 * x - sinTheta2 * y
-            node[1] = sinTheta2 * x + cosTheta2 * y
-            x = node[0]
-            z = node[2]
-            node[0] = cosTheta3 * x - sinTheta3 * z
-            node[2] = sinTheta3 * x + cosTheta3 * z
-            x = node[0]
-            y = node[1]
-            node[0] = cosTheta2 * x + sinTheta2 * y
-            node[1] = -sinTheta2 * x + cosTheta2 * y
-            x = node[0]
-            z = node[2]
-            node[0] = cosTheta1 * x + sinTheta1 * z
-            node[2] = -sinTheta1 * x + cosTheta1 * z
+        self.set_spin(self._spin_angle + speed)
+
+    def set_spin(self, angle):
+        ''' Spins the planet to an absolute angle around its axis, measured from its
+            original position. Each pose is computed from the unrotated nodes, so
+            repeated spins do not accumulate floating point drift.
+
+            Parameters:
+                angle (float) : The angle, in degrees, the planet has turned in the
+                                direction of spin.
+
+        '''
+        self.require('rotation')
+        self._spin_angle = angle
+        self.update_pose()
 
     def temp_rotate(self, speed):
         ''' Spins the planet around the Y axis at a certain speed. Speed is directly proportional
@@ -97,171 +227,295 @@ class PlanetObject(object):
                 speed (float) : The speed at which the planet is rotated.
                 
         '''
-        cosTheta3 = math.cos(math.radians(speed*self._axis_spin))
-        sinTheta3 = math.sin(math.radians(speed*self._axis_spin))
-        for node in self._nodes:
-            x = node[0]
-            z = node[2]
-            node[0] = cosTheta3 * x - sinTheta3 * z
-            node[2] = sinTheta3 * x + cosTheta3 * z
+        self.set_temp_rotation(self._rotate_angle + speed)
+
+    def set_temp_rotation(self, angle):
+        ''' Spins the planet to an absolute angle around the Y axis, measured from its
+            original position.
+
+            Parameters:
+                angle (float) : The angle, in degrees, the planet has turned in the
+                                direction of spin.
+
+        '''
+        self.require('rotation')
+        self._rotate_angle = angle
+        self.update_pose()
+
+    def get_axis_matrix(self):
+        ''' Returns the rotation matrix that takes the Y axis onto the planet's
+            rotational axis.
+
+        '''
+        return ps.rotation_matrix('xz', self._axis_azimuth_angle) @ ps.rotation_matrix('xy', self._axis_elevation_angle)
+
+    def get_pose_matrix(self, spin_speed=1):
+        ''' Returns the rotation matrix taking the unrotated nodes to their current
+            position: the rotation around the Y axis (temp_rotate) followed by the
+            spin around the planet's axis (spin).
+
+            Parameters:
+                spin_speed (float) : How fast the nodes spin relative to the surface
+                                     (e.g. for clouds drifting over it).
+
+        '''
+        axis = self.get_axis_matrix()
+        spin = axis @ ps.rotation_matrix('xz', self._spin_angle*spin_speed*self._axis_spin) @ axis.T
+        rotation = ps.rotation_matrix('xz', self._rotate_angle*self._axis_spin)
+        return spin @ rotation
+
+    @prof.profiled('spin')
+    def update_pose(self):
+        ''' Moves the nodes (and the cloud shell, if there are clouds) to the current
+            pose with a single matrix multiply each. Both are written into one array,
+            _draw_vertices, which is what the cloud faces of get_draw_mesh index. The
+            array is reused from pose to pose, and only allocated again when the number
+            of nodes changes or the cloud shell is added or removed.
+
+        '''
+        pose = self.get_pose_matrix()
+        node_count = len(self._base_vertices)
+        draw_count = node_count if self._base_cloud_vertices is None else 2*node_count
+        if getattr(self, '_draw_vertices', None) is None or len(self._draw_vertices) != draw_count:
+            self._draw_vertices = np.empty((draw_count, 3))
+
+        np.matmul(self._base_vertices, pose.T, out=self._draw_vertices[:node_count])
+        self._vertices = self._draw_vertices[:node_count]
+        if self._base_cloud_vertices is None:
+            return
+
+        if self._cloud_speed != 1:
+            pose = self.get_pose_matrix(self._cloud_speed)
+        np.matmul(self._base_cloud_vertices, pose.T, out=self._draw_vertices[node_count:])
+        self._cloud_vertices = self._draw_vertices[node_count:]
+
+    def reset_pose(self):
+        ''' Makes the current nodes the unrotated nodes that every later pose is
+            computed from.
+
+        '''
+        #The current nodes are a view of _draw_vertices, which the next pose overwrites
+        self._base_vertices = self._vertices.copy()
+        if self._base_cloud_vertices is not None:
+            self._base_cloud_vertices = self._cloud_vertices.copy()
+        self._spin_angle = 0
+        self._rotate_angle = 0
+        self.update_pose()
+
+    def set_cloud_speed(self, speed):
+        ''' Sets how fast the clouds spin around the planet's axis relative to the
+            surface: 1 keeps them fixed over the surface, and other values make them
+            drift over it as the planet spins.
+
+            Parameters:
+                speed (float) : The clouds' spin as a multiple of the surface's spin.
+
+        '''
+        self.require('rotation')
+        self._cloud_speed = speed
+        self.update_pose()
 
     def set_axis(self):
-        ''' Rotates the planet such that it is in line with its rotational axis.
+        ''' Rotates the planet, and its cloud shell, such that it is in line with its
+            rotational axis. The rotation is applied to the unrotated nodes, so any
+            current spin or rotation (see update_pose) is kept on top of it.
                 
         '''
-        cosTheta = math.cos(math.radians(self._axis_elevation_angle))
-        sinTheta = math.sin(math.radians(self._axis_elevation_angle))
-        cosTheta2 = math.cos(math.radians(self._axis_azimuth_angle))
-        sinTheta2 = math.sin(math.radians(self._axis_azimuth_angle))
-        for node in self._nodes:
-            x = node[0]
-            y = node[1]
-            node[0] = cosTheta * x - sinTheta * y
-            node[1] = sinTheta * x + cosTheta * y
-            x = node[0]
-            z = node[2]
-            node[0] = cosTheta2 * x - sinTheta2 * z
-            node[2] = sinTheta2 * x + cosTheta2 * z
+        axis = self.get_axis_matrix()
+        if self._base_vertices is None:
+            self._vertices = self._vertices @ axis.T
+            self.reset_pose()
+            return
+        self._base_vertices = self._base_vertices @ axis.T
+        if self._base_cloud_vertices is not None:
+            self._base_cloud_vertices = self._base_cloud_vertices @ axis.T
+        self.update_pose()
 
     def define_base_nodes(self):
         ''' Defines the first 12 nodes that make up the subdivided icosahedron.
                 
         '''
-        a = 1 / math.sqrt(11 + 2*math.sqrt(5))
-        phi = a * (1 + math.sqrt(5))/2
-        self._nodes = []
-        self._nodes.append(ps.change_distance([0, -a, -phi], self._radius))
-        self._nodes.append(ps.change_distance([0, -a, phi], self._radius))
-        self._nodes.append(ps.change_distance([0, a, -phi], self._radius))
-        self._nodes.append(ps.change_distance([0, a, phi], self._radius))
-        self._nodes.append(ps.change_distance([-a, -phi, 0], self._radius))
-        self._nodes.append(ps.change_distance([-a, phi, 0], self._radius))
-        self._nodes.append(ps.change_distance([a, -phi, 0], self._radius))
-        self._nodes.append(ps.change_distance([a, phi, 0], self._radius))
-        self._nodes.append(ps.change_distance([-phi, 0, -a], self._radius))
-        self._nodes.append(ps.change_distance([phi, 0, -a], self._radius))
-        self._nodes.append(ps.change_distance([-phi, 0, a], self._radius))
-        self._nodes.append(ps.change_distance([phi, 0, a], self._radius))
+        self._vertices = ps.change_distances(ps.get_icosahedron_nodes(), self._radius)
 
     def define_base_faces(self):
         ''' Defines the first 20 faces that make up the subdivided icosahedron.
 
         '''
-        self._faces = []
-        self._faces.append([0, 2, 8])
-        self._faces.append([0, 2, 9])
-        self._faces.append([1, 3, 10])
-        self._faces.append([1, 3, 11])
-        self._faces.append([0, 4, 6])
-        self._faces.append([1, 4, 6])
-        self._faces.append([2, 5, 7])
-        self._faces.append([3, 5, 7])
-        self._faces.append([4, 8, 10])
-        self._faces.append([5, 8, 10])
-        self._faces.append([6, 9, 11])
-        self._faces.append([7, 9, 11])
-        self._faces.append([0, 4, 8])
-        self._faces.append([0, 6, 9])
-        self._faces.append([1, 4, 10])
-        self._faces.append([1, 6, 11])
-        self._faces.append([2, 5, 8])
-        self._faces.append([2, 7, 9])
-        self._faces.append([3, 5, 10])
-        self._faces.append([3, 7, 11])
-
-    def complexify(self, complexity):
+        self._face_indices = ps.get_icosahedron_faces()
+        self._face_colors = None
+
+    @prof.profiled('complexify')
+    def define_mesh(self, complexity, shared_edges=True):
+        ''' Loads the nodes and faces of the planet at the given complexity from the
+            mesh cache, which holds them for a unit sphere. This gives the same mesh as
+            define_base_nodes, define_base_faces and complexify, without redoing the
+            subdivision for every planet.
+
+            Parameters:
+                complexity (int) : How far the planet will be subdivided.
+                shared_edges (boolean) : Whether faces sharing an edge also share its midpoint.
+
+        '''
+        nodes, faces = pc.get_base_mesh(complexity, shared_edges)
+        self._vertices = nodes*self._radius
+        self._face_indices = faces
+        self._face_colors = None
+        self._complexity = complexity
+        self._shared_edges = shared_edges
+
+    @prof.profiled('complexify')
+    def complexify(self, complexity, shared_edges=True):
         ''' Subdivides the icosahedron (the planet) [complexity] times. (i.e. if
             the complexity is 6, this will subdivided the planet 6 times.
 
             Parameters:
                 complexity (int) : How far the planet will be subdivided.
+                shared_edges (boolean) : If True, the midpoint of an edge is only added once
+                                         and shared by both faces on that edge, giving a
+                                         watertight grid of 10*4^complexity + 2 nodes. If False,
+                                         every face adds its own three midpoints.
                 
         '''   
         for x in range(complexity):
+            self._vertices, self._face_indices = ps.subdivide(self._vertices, self._face_indices, self._radius, shared_edges)
+
+    def get_vertex_adjacency(self):
+        ''' Returns the neighbouring nodes of every node on the planet.
+
+            Returns:
+                neighbours (list<array<int>>) : The sorted neighbours of each node.
+
+        '''
+        return ps.get_vertex_adjacency(self._face_indices, len(self._vertices))
+
+    def get_face_adjacency(self):
+        ''' Returns the faces bordering every face on the planet, with -1 for
+            edges that are not shared (only possible without shared_edges).
+
+            Returns:
+                neighbours (array<array<int, int, int>>) : An (F, 3) array of face indexes.
+
+        '''
+        return ps.get_face_adjacency(self._face_indices, len(self._vertices))
+
+    def get_face_levels(self):
+        ''' Returns the faces of every level of the subdivision, from the icosahedron
+            to the planet's complexity. Face i of one level is split into faces 4i to
+            4i+3 of the next (4i+3 being the centre one), and the nodes of a level are
+            the first nodes of the next, so every level indexes the planet's nodes.
 
-            new_faces = []
-            nodelength = len(self._nodes)
-
-            #When subdividing the grid, each face is split into 4 other faces.
-            #This means that an extra 3 nodes are needed; each node is inbetween
-            #two other nodes.
-            for i in range(len(self._faces)):
-
-                #Take a face from the original faces.
-                face = self._faces[i]
-
-                #For each combination of nodes in that face:
-                for j in range(3):
-                    for k in range(j+1, 3):
-                        #Create a node that is directly inbetween those two nodes,
-                        node1, node2 = self._nodes[face[j]], self._nodes[face[k]]
-                        midnode = (node1[0]/2+node2[0]/2, node1[1]/2+node2[1]/2, node1[2]/2+node2[2]/2)
-                        #And add it to the existing nodes
-                        self._nodes.append(ps.change_distance(midnode, self._radius))
-
-                #Additionally, take the three nodes that make up the face
-                node1num, node2num, node3num = face
-                node1, node2, node3 = self._nodes[node1num], self._nodes[node2num], self._nodes[node3num]
-
-                #And take the indexes of the new nodes that were just added to the face.
-                newnodenum1 = nodelength + i * 3
-                newnodenum2 = nodelength + i * 3 + 1
-                newnodenum3 = nodelength + i * 3 + 2
-
-                #And add 4 new faces such that each face is the combination
-                #of two new nodes and the node that was used to make both
-                #of them.
-                new_faces.append([node1num, newnodenum1, newnodenum2])
-                new_faces.append([node2num, newnodenum1, newnodenum3])
-                new_faces.append([node3num, newnodenum2, newnodenum3])
-                new_faces.append([newnodenum1, newnodenum2, newnodenum3])
-
-            #Then set the current faces to be the new faces
-            self._faces = new_faces
-
-        #And repeat this process [complexity] times.
+            Returns:
+                levels (list<array<array<int, int, int>>>) : The (20*4^k, 3) faces of each level k.
+
+        '''
+        if getattr(self, '_face_levels', None) is None:
+            self._face_levels = [pc.get_base_mesh(level, self._shared_edges)[1] for level in range(self._complexity)]
+            self._face_levels.append(self._face_indices)
+        return self._face_levels
+
+    def get_lod_faces(self, threshold, limb=0.25):
+        ''' Picks the faces to draw from the subdivision hierarchy, refining from the
+            icosahedron down only where faces would be more than [threshold] pixels
+            wide on screen. Faces near the limb are foreshortened on screen, so they are
+            refined by their true size instead to keep the outline smooth. Coarse faces
+            take the color (and cloud) of their centre face at the finest level.
+
+            Parameters:
+                threshold (float) : The widest a face may be drawn, in pixels.
+                limb (float) : Faces whose normal is within this of perpendicular to the
+                               viewer (in its z component) count as near the limb.
+
+            Returns:
+                faces (array<array<int, int, int>>) : The (K, 3) faces to draw.
+                colors (array<array<int>>) : Their (K, 4) colors.
+                cloud_faces (array<array<int, int, int>>) : The cloud faces to draw.
+                cloud_colors (array<array<int>>) : Their colors.
+
+        '''
+        self.require('biomes', 'clouds')
+        levels = self.get_face_levels()
+        finest = len(levels) - 1
+        selected = []
+        ids = np.arange(len(levels[0]))
+        for level, faces in enumerate(levels):
+            if level == finest:
+                selected.append((level, ids))
+                break
+
+            #Faces entirely behind the planet's centre (and so every face
+            #they split into) cannot be seen
+            corners = self._vertices[faces[ids]]
+            front = (corners[:, :, 2] >= 0).any(axis=1)
+            ids, corners = ids[front], corners[front]
+
+            edges = corners - np.roll(corners, 1, axis=1)
+            projected_size = np.sqrt((edges[:, :, :2]**2).sum(axis=2)).max(axis=1)
+            true_size = np.sqrt((edges**2).sum(axis=2)).max(axis=1)
+            normals = np.cross(edges[:, 1], edges[:, 2])
+            facing = normals[:, 2]/np.maximum(np.sqrt((normals**2).sum(axis=1)), 1e-12)
+
+            refine = (projected_size > threshold) | ((np.abs(facing) < limb) & (true_size > threshold))
+            selected.append((level, ids[~refine]))
+            ids = (4*ids[refine, None] + np.arange(4)).ravel()
+
+        faces = np.concatenate([levels[level][ids] for level, ids in selected])
+        #The centre face of face i, d levels further down, is 4^d*i + 4^d - 1
+        centres = np.concatenate([ids*4**(finest - level) + 4**(finest - level) - 1 for level, ids in selected])
+        colors = self._face_colors[centres]
+        cloud_faces = faces[self._clouds[centres]]
+        cloud_colors = np.zeros((len(cloud_faces), 4), dtype=np.uint8)
+        if len(cloud_faces) > 0:
+            cloud_colors[:] = self._planet.get_cloud_color()
+        return faces, colors, cloud_faces, cloud_colors
             
 
+    @prof.profiled('assign_biomes')
     def assign_biomes(self):
         ''' Assigns a biome to every face on the planet according to its moisture
             level and elevation.
                 
         '''
-        #For each face on the grid,
-        for face in self._faces:
-            node1, node2, node3 = self._nodes[face[0]], self._nodes[face[1]], self._nodes[face[2]]
-
-            #Get the node directly in the centre of the face
-            mid = ps.get_middle_point(node1, node2, node3)
+        #Get the node directly in the centre of every face
+        #(before the planet is spun)
+        mids, heights = self.get_face_centroids()
 
-            #And check the planet_type to see what biome that node should be
-            biome_color = self._planet.get_biome(mid)
+        #And check the planet_type to see what biome those nodes should be
+        biome_colors = self._planet.get_biome_array(mids, heights)
 
-            #Then add that biome color to the node for later reference.
-            face.append(biome_color)
+        #Then store those biome colors for later reference.
+        self._face_colors = np.array(biome_colors, dtype=np.uint8).reshape(-1, 4)
         
 
+    @prof.profiled('gen_terrain')
     def gen_terrain(self):
         ''' Assigns a pseudo-random height to every node on the planet.
                 
         '''
         #Generate an array of node numbers which islands should be located
         #(if applicable for that planet type)
-        island_array = self._planet.get_islands(self._nodes)
-        new_nodes = []
-        #For each node in the grid
-        for node in self._nodes:
-            #Ask the planet_type how high that node should be (taking into account
-            #possible islands)
-            noise = self._planet.get_terrain_noise(node, island_array)
-            multiplier = 1 + noise
-
-            #And then change that node to be that height
-            new_nodes.append(ps.change_distance(node, self._radius*multiplier))
-            
-        self._nodes = new_nodes
+        island_array = self._planet.get_islands(self._base_vertices)
+
+        #Ask the planet_type how high every node should be (taking into account
+        #possible islands)
+        noise = self._planet.get_terrain_noise_array(self._base_vertices, island_array)
+        self.set_elevation(noise)
+
+    def set_elevation(self, elevation):
+        ''' Moves every node to its height above the planet's radius.
+
+            Parameters:
+                elevation (array<float>) : The height of every node as a fraction of the radius.
+
+        '''
+        self._elevation = elevation
+        multiplier = 1 + elevation
+
+        #Change the nodes to be that height, keeping the current pose
+        self._base_vertices = ps.change_distances(self._base_vertices, self._radius*multiplier)
+        self.update_pose()
         
 
+    @prof.profiled('gen_clouds')
     def gen_clouds(self):
         ''' If the planet has clouds, this will generate random clouds.
             Clouds are generated from the existing faces on the planet;
@@ -270,20 +524,145 @@ class PlanetObject(object):
             height when printed on a GifCanvas.
 
         '''
-        self._cloud_faces = []
-
-        #For each face in the grid.
-        for face in self._faces:
-            #Get the node in the centre of the face.
-            n1, n2, n3 = self._nodes[face[0]], self._nodes[face[1]], self._nodes[face[2]]
-            mid = ps.get_middle_point(n1, n2, n3)
-            #Retrieve the cloud color
-            cloud_color = self._planet.get_cloud_color()
-            #If the face is a cloud,
-            if self._planet.is_cloud(mid):
-                #Add it to the cloud faces.
-                new_cloud = face[:-1] + [cloud_color]
-                self._cloud_faces.append(new_cloud)
+        #Get the node in the centre of every face in the grid
+        #(before the planet is spun).
+        mids = self.get_face_centroids()[0]
+
+        #Every face which is a cloud is added to the cloud faces
+        #with the cloud color.
+        self.set_clouds(self._planet.is_cloud_array(mids))
+
+    def set_clouds(self, clouds):
+        ''' Makes the given faces the planet's cloud faces.
+
+            Parameters:
+                clouds (array<boolean>) : Whether each face is a cloud.
+
+        '''
+        self._clouds = clouds
+        self._cloud_indices = self._face_indices[clouds]
+        self._cloud_colors = np.zeros((len(self._cloud_indices), 4), dtype=np.uint8)
+        if len(self._cloud_indices) > 0:
+            self._cloud_colors[:] = self._planet.get_cloud_color()
+
+        #The cloud shell has a node above every node of the planet at the cloud
+        #height, posed along with the planet (see update_pose)
+        self._base_cloud_vertices = None
+        if len(self._cloud_indices) > 0:
+            self._base_cloud_vertices = ps.change_distances(self._base_vertices, self._planet.get_cloud_height())
+        self.update_pose()
+
+    def get_draw_mesh(self):
+        ''' Returns the faces and colors of the planet and its clouds as one mesh over
+            _draw_vertices (the cloud faces index the cloud shell after the nodes).
+            The arrays are only rebuilt when the faces, biomes or clouds change.
+
+            Returns:
+                faces (array<array<int, int, int>>) : The (F+C, 3) faces.
+                colors (array<array<int>>) : Their (F+C, 4) colors.
+
+        '''
+        self.require('biomes', 'clouds')
+
+        def build():
+            faces, colors = self._face_indices, self._face_colors
+            if self._base_cloud_vertices is not None:
+                faces = np.concatenate((faces, self._cloud_indices + len(self._vertices)))
+                colors = np.concatenate((colors, self._cloud_colors))
+            return faces, colors
+
+        return self._memoize('_draw_mesh', (self._face_indices, self._face_colors, self._cloud_indices), build)
+
+    def get_face_centroids(self):
+        ''' Returns the centre of every face before the planet is spun, along with its
+            height from the planet's centre. They are computed once
+            for the current nodes and shared by every per-face pass (biomes, clouds and
+            the depth faces are sorted by).
+
+            Returns:
+                centroids (array<array<float, float, float>>) : An (F, 3) array of face centres.
+                heights (array<float>) : The (F,) distance of each centre from the planet's centre.
+
+        '''
+        def build():
+            centroids = ps.get_middle_points(self._base_vertices, self._face_indices)
+            heights = ps.get_heights(centroids)
+            return centroids, heights
+
+        return self._memoize('_face_centroids', (self._base_vertices, self._face_indices), build)
+
+    def get_draw_depths(self, faces):
+        ''' Returns the current z coordinate of the centre of some of the faces of
+            get_draw_mesh, which they are sorted by when drawn in depth order.
+
+            Parameters:
+                faces (array<int>) : Indexes of faces of get_draw_mesh.
+
+            Returns:
+                depths (array<float>) : The z coordinate of each face's centre.
+
+        '''
+        self.require('biomes', 'clouds')
+
+        def build():
+            centroids = self.get_face_centroids()[0]
+            if self._base_cloud_vertices is not None:
+                cloud_centroids = ps.get_middle_points(self._base_cloud_vertices, self._cloud_indices)
+                centroids = np.concatenate((centroids, cloud_centroids))
+            return centroids
+
+        key = (self._base_vertices, self._face_indices, self._base_cloud_vertices, self._cloud_indices)
+        centroids = self._memoize('_draw_centroids', key, build)[faces]
+        depths = centroids @ self.get_pose_matrix()[2]
+        if self._base_cloud_vertices is not None and self._cloud_speed != 1:
+            clouds = faces >= len(self._face_indices)
+            depths[clouds] = centroids[clouds] @ self.get_pose_matrix(self._cloud_speed)[2]
+        return depths
+
+    def _memoize(self, name, key, build):
+        #Keeps the result of build() in attribute [name] until one of the
+        #arrays in [key] is replaced
+        cached = getattr(self, name, None)
+        if cached is None or len(cached[0]) != len(key) or any(a is not b for a, b in zip(cached[0], key)):
+            cached = (key, build())
+            setattr(self, name, cached)
+        return cached[1]
+
+    def get_field_key(self):
+        ''' Returns the key the planet's generated fields are cached under: its type,
+            seed, diameter, mesh and rotational axis (the fields are generated on the
+            nodes once they are in line with the axis).
+
+        '''
+        axis = (self._axis_spin, self._axis_elevation_angle, self._axis_azimuth_angle)
+        return pc.get_field_key(self._field_version, type(self._planet).__name__, self._planet._seed,
+                                self._planet.get_diameter(), self._complexity, self._shared_edges, axis)
+
+    def load_fields(self):
+        ''' Loads the planet's elevation, biome colors and clouds from the field cache
+            (see planet_cache.load_fields), skipping their generation.
+
+            Returns:
+                loaded (boolean) : Whether the fields were in the cache.
+
+        '''
+        fields = pc.load_fields(self.get_field_key())
+        if fields is None:
+            return False
+        #Fields that do not fit the mesh (e.g. from a damaged file) are generated instead
+        if (len(fields['elevation']) != len(self._base_vertices) or len(fields['colors']) != len(self._face_indices)
+                or len(fields['clouds']) != len(self._face_indices)):
+            return False
+        self.set_elevation(fields['elevation'])
+        self._face_colors = fields['colors']
+        self.set_clouds(fields['clouds'])
+        return True
+
+    def save_fields(self):
+        ''' Stores the planet's elevation, biome colors and clouds in the field cache.
+
+        '''
+        pc.save_fields(self.get_field_key(), elevation=self._elevation, colors=self._face_colors, clouds=self._clouds)
     
 
 class GifCanvas:
@@ -291,20 +670,33 @@ class GifCanvas:
        onto a .gif file.
         
     '''
-    def __init__(self, canvas_size, background_color):
+    def __init__(self, canvas_size, background_color, rasterizer='pil', star_seed=None, lod_threshold=None):
         ''' Initializes the GifCanvas object.
 
             Parameters:
                 canvas_size (tuple<int, int>) : The dimensions of the resulting .gif.
                 background_color (tuple<int, int, int, int>) : The color of the background.
+                rasterizer (str) : How faces are drawn; 'pil' draws each face with
+                                   ImageDraw.polygon in depth order, 'numpy' draws all
+                                   faces at once into a z-buffered array (see planet_raster).
+                star_seed (int) : The seed used to place the background stars (random if None).
+                lod_threshold (float) : If given, bodies are drawn with faces from the coarsest
+                                        level of their subdivision that keeps faces under this
+                                        many pixels wide (see PlanetObject.get_lod_faces),
+                                        instead of with every face.
                 
         '''
+        if rasterizer not in ('pil', 'numpy'):
+            raise ValueError('Unknown rasterizer: {}'.format(rasterizer))
+        self._rasterizer = rasterizer
+        self._lod_threshold = lod_threshold
         self._canvas_width, self._canvas_height = canvas_size
         self._canvas_size = canvas_size
         self._background_color = background_color
         self._gif_images = []
         self._bodies = {}
-        self.gen_base_canvas(1, 1)
+        self._frame_stats = {}
+        self.gen_base_canvas(1, 1, star_seed)
         self.set_lighting([0, 0, 1])
 
     def set_lighting(self, light_vector):
@@ -316,19 +708,17 @@ class GifCanvas:
         '''
         self._light_vector = light_vector
 
-    def gen_base_canvas(self, star_min_size, star_max_size):
+    def gen_base_canvas(self, star_min_size, star_max_size, seed=None):
         ''' Creates the canvas on which the planet is printed, including stars.
+            The canvas is a read-only array shared by every canvas with the same
+            size, seed and star sizes (see planet_raster.get_starfield).
 
             Parameters:
-                star_number (int) : Number of stars in the background
                 star_min_size (int) : The minimum star size in pixels wide.
                 star_max_size (int) : The maximum star size in pixels wide.
+                seed (int) : The seed used to place the stars (random if None).
                 
         '''
-        #Create the base canvas
-        self._base_canvas = Image.new("RGB", self._canvas_size, color=self._background_color)
-        base_canvas_draw = ImageDraw.Draw(self._base_canvas, 'RGBA')
-
         #Different star colours
         greenwhite_star = (204, 255, 204, 255)
         blue_star = (153, 204, 255, 255)
@@ -348,78 +738,142 @@ class GifCanvas:
         colors.append(orangered_star)
         colors.append(red_star)
 
-        #Create a number of stars with a random star colour
-        #and random position.
-        for i in range(int(self._canvas_width*self._canvas_height/1000)):
-            r, g, b, a = colors[random.randrange(8)]
-            star_color = (r, g, b, int(a*random.random()*0.5))
-            xcentre = random.randrange(self._canvas_width)
-            ycentre = random.randrange(self._canvas_height)
-            star_size = random.randrange(star_min_size, star_max_size+1)
-            coordinates = [xcentre-math.ceil(star_size/2), ycentre-math.ceil(star_size/2), xcentre+math.ceil(star_size/2), ycentre+math.ceil(star_size/2)]
-            base_canvas_draw.ellipse(coordinates, fill=star_color)
-        
-        
+        self._star_colors = colors
+
+        #Create the base canvas with a number of stars
+        #Unseeded starfields take fresh entropy from the OS rather than the global random state,
+        #and are drawn without the cache since they are never asked for again
+        if seed is None:
+            self._base_canvas = pr.draw_starfield(tuple(self._canvas_size), tuple(self._background_color),
+                                                  tuple(colors), star_min_size, star_max_size, np.random.SeedSequence().entropy)
+        else:
+            self._base_canvas = pr.get_starfield(tuple(self._canvas_size), tuple(self._background_color),
+                                                 tuple(colors), star_min_size, star_max_size, seed)
+        self._framebuffer = None
 
     def draw_image(self):
-        ''' Draws a single image using a planet object.
+        ''' Draws a single image using a planet object. Faces facing away from the
+            viewer are culled before they are lit, and the number of visible faces
+            along with the time spent culling and shading is kept in _frame_stats.
                 
         '''
-        self._canvas = self._base_canvas.copy()
-        canvas_draw = ImageDraw.Draw(self._canvas, 'RGBA')
+        if self._rasterizer == 'numpy':
+            framebuffer, zbuffer = self.get_framebuffer()
+        else:
+            self._canvas = Image.fromarray(self._base_canvas)
+            canvas_draw = ImageDraw.Draw(self._canvas, 'RGBA')
+        view = np.array([0, 0, 1])
+        self._frame_stats = {'faces': 0, 'visible': 0, 'cull_seconds': 0, 'shade_seconds': 0, 'saved_seconds': 0}
 
-        draw_faces = []
-        
         for body, position in self._bodies.items():
-            #Add normal faces to the draw list as separate arrays
-            #with the zcoord at the front of the array
-            for face in body._faces:
-                n1, n2, n3 = body._nodes[face[0]], body._nodes[face[1]], body._nodes[face[2]]
-                mid = ps.get_middle_point(n1, n2, n3)
-                zcoord = mid[2]
-                color = ps.lighting(n1, n2, n3, face[3], self._light_vector, body._attr)
-                #color = (120, 120, 0, 255)
-                #for testing lighting
-                draw_faces.append((zcoord, n1, n2, n3, color, position))
-
-            draw_faces = sorted(draw_faces)[math.ceil(len(draw_faces)/2):len(draw_faces)]
-                
-            #level 5 takes 0.7 seconds
-            #so about 65% of rendering time
-            #lighting takes up ~70% of this time
-
-            #Add cloud faces to the draw list
-            #This follows the same logic as normal faces.
-            for face in body._cloud_faces:
-                n1, n2, n3, color = body._nodes[face[0]], body._nodes[face[1]], body._nodes[face[2]], face[3]
-                cloud_height = body._planet.get_cloud_height()
-                n1 = ps.change_distance(n1, cloud_height)
-                n2 = ps.change_distance(n2, cloud_height)
-                n3 = ps.change_distance(n3, cloud_height)
-                mid = ps.get_middle_point(n1, n2, n3)
-                zcoord = mid[2]
-                color = ps.lighting(n1, n2, n3, color, self._light_vector, body._attr)
-                draw_faces.append((zcoord, n1, n2, n3, color, position))
-                
-            #level 5 takes 0.03 seconds
-            #so about 3% of rendering time
+            #Cloud faces index the cloud shell after the planet's nodes, and
+            #are culled and shaded together with the other faces.
+            if self._lod_threshold is None:
+                faces, face_colors = body.get_draw_mesh()
+            else:
+                with prof.stage('lod'):
+                    faces, face_colors, cloud_indices, cloud_colors = body.get_lod_faces(self._lod_threshold)
+                    if len(cloud_indices) > 0:
+                        faces = np.concatenate((faces, cloud_indices + len(body._vertices)))
+                        face_colors = np.concatenate((face_colors, cloud_colors))
+            nodes = body._draw_vertices
+
+            #Only faces whose normal points towards the viewer are kept
+            start = time.perf_counter()
+            with prof.stage('culling'):
+                normals = ps.get_normals(nodes, faces)
+                visible = np.flatnonzero(normals @ view > 0)
+            cull_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with prof.stage('shading'):
+                #The depth of each face's centre is used for both fog and sorting
+                if self._lod_threshold is None:
+                    depths = body.get_draw_depths(visible)
+                else:
+                    depths = nodes[faces[visible], 2].sum(axis=1)/3
+                faces = faces[visible]
+                colors = ps.lighting_array(nodes, faces, face_colors[visible], self._light_vector, body._attr, normals[visible], depths)
+            shade_seconds = time.perf_counter() - start
+
+            corners = nodes[faces]
+            xc, yc = position[0], position[1]
+            if self._rasterizer == 'numpy':
+                #The z-buffer keeps the closest face at each pixel, so no sort is needed
+                with prof.stage('rasterizing'):
+                    if len(corners) > 0:
+                        self.add_drawn_box(corners[:, :, 0].min() + xc, corners[:, :, 0].max() + xc,
+                                           corners[:, :, 1].min() + yc, corners[:, :, 1].max() + yc)
+                    pr.rasterize(framebuffer, zbuffer, corners[:, :, :2] + (xc, yc), corners[:, :, 2], colors)
+            else:
+                #Sort the visible faces by the z coord of their middle
+                with prof.stage('sorting'):
+                    order = np.argsort(depths, kind='stable')
+
+                #Draw the faces in the draw list
+                with prof.stage('rasterizing'):
+                    points = (corners[order, :, :2] + (xc, yc)).tolist()
+                    for (p1, p2, p3), fillcolor in zip(points, colors[order].tolist()):
+                        canvas_draw.polygon([tuple(p1), tuple(p2), tuple(p3)], fill=tuple(fillcolor))
+
+            #The time saved is estimated as the time it would have taken to
+            #shade the culled faces.
+            culled = len(normals) - len(visible)
+            self._frame_stats['faces'] += len(normals)
+            self._frame_stats['visible'] += len(visible)
+            self._frame_stats['cull_seconds'] += cull_seconds
+            self._frame_stats['shade_seconds'] += shade_seconds
+            self._frame_stats['saved_seconds'] += shade_seconds*culled/max(len(visible), 1)
+
+        if self._rasterizer == 'numpy':
+            self._canvas = Image.fromarray(framebuffer)
+        return self._canvas
 
-            #Sort the faces by z coordinate
-            draw_faces = sorted(draw_faces)
-            
-            #level 5 takes 0.05 seconds
-            #so about 5% of rendering time
-
-            #Draw the faces in the draw list
-            for face in draw_faces:
-                xc, yc = face[5]
-                fillcolor = face[4]
-                canvas_draw.polygon([(face[1][0]+xc, face[1][1]+yc),(face[2][0]+xc, face[2][1]+yc),(face[3][0]+xc, face[3][1]+yc)], fill=fillcolor)
-                
-            #level 5 takes 0.3 seconds
-            #so about 28% of rendering time
+    def get_framebuffer(self):
+        ''' Returns the framebuffer and z-buffer the 'numpy' rasterizer draws into, cleared
+            back to the starfield. Both are kept between frames, and only the box the bodies
+            were drawn in last frame is copied back from the starfield rather than the
+            whole canvas.
 
-        return self._canvas
+            Returns:
+                framebuffer (array<array<array<int>>>) : An (H, W, 3) uint8 array.
+                zbuffer (array<array<float>>) : An (H, W) array, -inf everywhere.
+
+        '''
+        if self._framebuffer is None:
+            self._framebuffer = self._base_canvas.copy()
+            self._zbuffer = np.full(self._framebuffer.shape[:2], -np.inf)
+        elif self._drawn_box is not None:
+            box = self._drawn_box
+            self._framebuffer[box] = self._base_canvas[box]
+            self._zbuffer[box] = -np.inf
+        self._drawn_box = None
+        return self._framebuffer, self._zbuffer
+
+    def add_drawn_box(self, xmin, xmax, ymin, ymax):
+        ''' Grows the box of the framebuffer drawn in this frame to include the pixels
+            from [xmin] to [xmax] and [ymin] to [ymax], so get_framebuffer can clear it.
+
+            Parameters:
+                xmin, xmax (float) : The horizontal extent of what is drawn.
+                ymin, ymax (float) : The vertical extent of what is drawn.
+
+        '''
+        height, width = self._zbuffer.shape
+        x0, x1 = max(int(np.floor(xmin)), 0), min(int(np.ceil(xmax)) + 1, width)
+        y0, y1 = max(int(np.floor(ymin)), 0), min(int(np.ceil(ymax)) + 1, height)
+        if self._drawn_box is not None:
+            x0, x1 = min(x0, self._drawn_box[1].start), max(x1, self._drawn_box[1].stop)
+            y0, y1 = min(y0, self._drawn_box[0].start), max(y1, self._drawn_box[0].stop)
+        self._drawn_box = (slice(y0, y1), slice(x0, x1))
+
+    def get_frame_stats(self):
+        ''' Returns the culling statistics of the last drawn image: the number of
+            faces, the number of visible faces and the seconds spent culling,
+            shading and (estimated) saved by culling.
+
+        '''
+        return self._frame_stats
 
     def add_body(self, body, position='centre'):
         ''' Adds a planet to the GifCanvas object. All added objects will be drawn.
@@ -454,30 +908,159 @@ class GifCanvas:
                 
         '''
         image = self.draw_image()
-        image.save(filepath, "GIF")
+        with prof.stage('encoding'):
+            image.save(filepath, "GIF")
 	
 
-    def make_gif(self, fps=60, filepath='movie.gif'):
+    def get_palette(self, size=256):
+        ''' Builds one palette for every frame drawn by the GifCanvas out of the colors
+            that can appear. The background and the stars (at 16 brightnesses, and
+            where they overlap) always have their own entries, and the biome and cloud
+            colors of each body after lighting and fog share the rest.
+
+            Parameters:
+                size (int) : The largest number of colors in the palette.
+
+            Returns:
+                palette (array<array<int, int, int>>) : A (K, 3) uint8 array of colors.
+
+        '''
+        #The background and stars never change, so they are given entries of their
+        #own. Stars are drawn with up to half opacity over the background, blended
+        #the same way as in pr.get_starfield, at 16 evenly spaced opacities.
+        background = np.array(self._background_color[:3], dtype=np.int64)
+        stars = np.array(self._star_colors, dtype=np.int64)[None, :, :]
+        alpha = (np.linspace(0, 0.5, 16)[:, None]*stars[:, :, 3]).astype(np.int64)[:, :, None]
+        blend = background*(255 - alpha) + stars[:, :, :3]*alpha + 128
+        reserved = np.concatenate(([background], (((blend >> 8) + blend) >> 8).reshape(-1, 3)))
+
+        #Where stars overlap they blend into other colors, and the few of those that
+        #are far from every reserved color get entries too
+        field = np.asarray(self._base_canvas, dtype=np.uint32).reshape(-1, 3)
+        field = np.unique((field[:, 0] << 16) | (field[:, 1] << 8) | field[:, 2])
+        field = np.stack(((field >> 16) & 255, (field >> 8) & 255, field & 255), axis=1).astype(np.int64)
+        distance = np.abs(field[:, None, :] - reserved[None, :, :]).max(axis=2).min(axis=1)
+        reserved = np.concatenate((reserved, field[distance > 6][:16]))
+
+        #Faces are lit by at most the strength of the light, and fogged
+        #depending on how far they are in front of the planet's centre
+        colors = []
+        diffuse = np.linspace(0, ps.get_height(self._light_vector), 24)
+        for body in self._bodies:
+            depth = np.linspace(0, body._radius*1.1, 12)
+            body_colors = np.array(body._planet.get_colors())
+            color, light, z = np.meshgrid(np.arange(len(body_colors)), diffuse, depth, indexing='ij')
+            shaded = ps.shade_colors(body_colors[color.ravel()], light.ravel(), z.ravel(), body._attr['atmosphere'])
+            colors.append(shaded[:, :3])
+
+        return pg.build_palette(np.concatenate(colors), size, reserved)
+
+    def draw_frame(self, index, frames=360, spin_axis=True):
+        ''' Poses every body for one frame of a full rotation and draws it. Each frame
+            is posed from its absolute angle rather than by turning the previous frame,
+            so frames can be drawn in any order (or in different processes).
+
+            Parameters:
+                index (int) : The number of the frame, from 0 to [frames]-1.
+                frames (int) : The number of frames in a full rotation.
+                spin_axis (boolean) : Whether bodies spin around their own axis (True)
+                                      or around the Y axis (False).
+
+            Returns:
+                image (Image) : The drawn frame.
+
+        '''
+        angle = (index+1)*360/frames
+        for body in self._bodies:
+            if spin_axis:
+                body.set_spin(angle)
+            else:
+                body.set_temp_rotation(angle)
+        return self.draw_image()
+
+    def make_gif(self, fps=60, filepath='movie.gif', spin_axis=True, frames=360, workers=1, stream=True, global_palette=False):
         ''' Generates a gif of the planets currently loaded in the GifCanvas.
 
             Parameters:
                 fps (int) : The desired frames per second of the final gif.
                 filepath (str) : Where the gif will be saved.
+                spin_axis (boolean) : Whether bodies spin around their own axis (True)
+                                      or around the Y axis (False).
+                frames (int) : The number of frames in one full rotation.
+                workers (int) : The number of processes frames are drawn in. If more
+                                than 1, frames are drawn in a process pool and gathered
+                                in order; the result is identical to drawing them here.
+                stream (boolean) : If True, each frame is encoded and written as soon as
+                                   it is drawn, so memory use does not grow with the
+                                   number of frames. If False, frames are kept in
+                                   _gif_images and saved at the end with save_gif.
+                global_palette (boolean) : If True (and streaming a .gif), every frame uses one
+                                           palette from get_palette and only the part of each
+                                           frame that changed is stored.
                 
         '''
         self._gif_images = []
-        for i in range(360):
-            for body, position in self._bodies.items():
-                #body.spin(2) Removed until I find a more optimised version because it takes fucking forever to spin this shit
-                #beyblades let em rip
-                body.temp_rotate(1)
-                image = self.draw_image()
-                image = np.asarray(image)
-                self._gif_images.append(image)
-            print('Image', i+1, 'completed.')
-                
-        self.save_gif(fps, filepath)
+        palette = self.get_palette() if global_palette else None
+        writer = pg.get_writer(filepath, fps, palette) if stream else None
+        try:
+            for i, (image, stats) in enumerate(self.render_frames(frames, spin_axis, workers)):
+                if stream:
+                    with prof.stage('encoding'):
+                        writer.append_data(image)
+                else:
+                    self._gif_images.append(image)
+                print('Image', i+1, 'completed.', '({visible}/{faces} faces visible, ~{saved:.1f}ms saved by culling)'.format(saved=stats['saved_seconds']*1000, **stats))
+        finally:
+            if stream:
+                writer.close()
+
+        if stream:
+            print('Gif saved!')
+        else:
+            self.save_gif(fps, filepath)
+
+    def render_frames(self, frames=360, spin_axis=True, workers=1):
+        ''' Draws every frame of a full rotation, in order.
+
+            Parameters:
+                frames (int) : The number of frames in one full rotation.
+                spin_axis (boolean) : Whether bodies spin around their own axis (True)
+                                      or around the Y axis (False).
+                workers (int) : The number of processes frames are drawn in.
+
+            Returns:
+                frames (generator<tuple<array, dict>>) : Each frame as an (H, W, 3) array
+                                                         along with its frame stats.
 
+        '''
+        if workers <= 1:
+            for i in range(frames):
+                image = np.asarray(self.draw_frame(i, frames, spin_axis))
+                yield image, self.get_frame_stats()
+            return
+
+        #At most [max_pending] frames are queued or waiting to be yielded at
+        #once; frames that finish early wait in their future until all of the
+        #frames before them have been yielded.
+        max_pending = 2*workers
+        profile = prof.is_enabled()
+        #Generate every layer here, rather than once in every worker
+        for body in self._bodies:
+            body.require(*body.layers)
+        global _worker_canvas
+        try:
+            with _frame_pool(self, workers) as executor:
+                pending = collections.deque()
+                for i in range(frames):
+                    pending.append(executor.submit(_render_frame, i, frames, spin_axis, profile))
+                    if len(pending) >= max_pending:
+                        yield _gather_frame(pending.popleft())
+                while pending:
+                    yield _gather_frame(pending.popleft())
+        finally:
+            #Forked workers inherit the canvas from here, which would otherwise keep
+            #it (and every body's mesh) alive once the frames are drawn
+            _worker_canvas = None
 
     def save_gif(self, fps=60, filepath='movie.mp4'):
         ''' Saves a gif of the planets currently loaded in the GifCanvas.
@@ -488,10 +1071,53 @@ class GifCanvas:
                 
         '''
         if self._gif_images != []:
-            imageio.mimsave(filepath, self._gif_images, fps=fps)
+            with prof.stage('encoding'):
+                imageio.mimsave(filepath, self._gif_images, fps=fps)
             print('Gif saved!')
 
 
+#The GifCanvas drawn by the worker processes of render_frames. It is set before
+#the pool is created so that forked workers inherit it instead of receiving a
+#copy of the planets with every frame.
+_worker_canvas = None
+
+def _init_frame_worker(gifcanvas):
+    global _worker_canvas
+    _worker_canvas = gifcanvas
+
+def _render_frame(index, frames, spin_axis, profile=False):
+    if profile:
+        #Only this frame is recorded, and the report is merged by the parent
+        if not prof.is_enabled():
+            prof.enable(memory=False)
+        prof.reset()
+    image = np.asarray(_worker_canvas.draw_frame(index, frames, spin_axis))
+    report = prof.get_report() if profile else None
+    return image, _worker_canvas.get_frame_stats(), report
+
+def _gather_frame(future):
+    image, stats, report = future.result()
+    if report is not None:
+        prof.merge_report(report)
+    return image, stats
+
+def _frame_pool(gifcanvas, workers):
+    ''' Creates a process pool whose workers each hold [gifcanvas]. Where processes
+        are started by forking (the default start method on Linux), the workers
+        inherit it; otherwise it is sent once to each worker when it starts. Fork is
+        never forced where it is not the default (e.g. macOS, where it is unsafe).
+
+    '''
+    global _worker_canvas
+    if multiprocessing.get_start_method() == 'fork':
+        #Threads are not copied into forked processes, so the noise threads are
+        #stopped rather than left in an unknown state in the workers
+        ps.shutdown_noise_executor()
+        _worker_canvas = gifcanvas
+        return ProcessPoolExecutor(workers)
+    return ProcessPoolExecutor(workers, initializer=_init_frame_worker, initargs=(gifcanvas,))
+
+
 def main():
 
     background_color = (0, 0, 0, 255)
@@ -510,12 +1136,13 @@ def main():
     gifcanvas.set_lighting(light_vector)
     gifcanvas.make_gif()
 
-def make_gif(complexity):
+def make_gif(complexity, seed=None):
     background_color = (0, 0, 0, 255)
     canvas_size = (750, 750)
 
     #create the planet type and planet object
-    seed = random.random()
+    if seed is None:
+        seed = random.random()
     planettype = pt.EarthAnalog(450, seed)
     planet = PlanetObject(planettype, complexity)
 
@@ -526,11 +1153,12 @@ def make_gif(complexity):
     gifcanvas.set_lighting(light_vector)
     gifcanvas.make_gif()
 
-def make_img(complexity):
+def make_img(complexity, seed=None):
     background_color = (0, 0, 0, 255)
     canvas_size = (1280, 720)
 
-    seed = random.random()
+    if seed is None:
+        seed = random.random()
     planet_types = [pt.EarthAnalog(500, seed),
                     pt.IronPlanet(500, seed),
                     pt.IcePlanet(500, seed)]
@@ -545,4 +1173,13 @@ def make_img(complexity):
     gifcanvas.make_img()
     
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a planet and save its animation.')
+    parser.add_argument('--profile', nargs='?', const='profile.json', default=None, metavar='FILEPATH',
+                        help='Record the time and memory of each stage and save them as JSON.')
+    options = parser.parse_args()
+    if options.profile is not None:
+        prof.enable()
     main()
+    if options.profile is not None:
+        print(prof.format_report())
+        prof.save_report(options.profile)
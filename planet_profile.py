@@ -0,0 +1,165 @@
+import contextlib
+import functools
+import json
+import time
+import tracemalloc
+
+#Whether stages are being recorded. While False, stage() and profiled() do
+#nothing beyond checking this flag.
+_enabled = False
+
+#Whether the peak memory of each stage is recorded (using tracemalloc)
+_track_memory = False
+
+#The wall time, call count and peak memory of every stage, by name
+_stats = {}
+
+#The stages currently running, innermost last, as [name, start memory, peak memory]
+_running = []
+
+_disabled_stage = contextlib.nullcontext()
+
+
+def enable(memory=True):
+    ''' Starts recording stages, clearing anything recorded before.
+
+        Parameters:
+            memory (boolean) : Whether the peak memory of each stage is recorded.
+                               This uses tracemalloc, which slows down allocations.
+
+    '''
+    global _enabled, _track_memory
+    reset()
+    _enabled = True
+    _track_memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable():
+    ''' Stops recording stages. What has been recorded is kept until enable or reset.
+
+    '''
+    global _enabled, _track_memory
+    if _track_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _enabled = False
+    _track_memory = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    ''' Clears every recorded stage.
+
+    '''
+    _stats.clear()
+    del _running[:]
+
+def stage(name):
+    ''' Returns a context manager recording the time and memory of the code run in
+        it under the stage [name].
+
+        Parameters:
+            name (str) : The name of the stage (e.g. 'shading').
+
+    '''
+    if not _enabled:
+        return _disabled_stage
+    return _record(name)
+
+def profiled(name):
+    ''' Decorates a function so that every call is recorded as the stage [name].
+
+        Parameters:
+            name (str) : The name of the stage (e.g. 'gen_terrain').
+
+    '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _record(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextlib.contextmanager
+def _record(name):
+    if _track_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        #The peak so far belongs to the enclosing stage before it is reset
+        if _running:
+            _running[-1][2] = max(_running[-1][2], peak)
+        tracemalloc.reset_peak()
+        _running.append([name, current, current])
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        stats = _stats.setdefault(name, {'seconds': 0, 'calls': 0, 'peak_bytes': 0})
+        stats['seconds'] += seconds
+        stats['calls'] += 1
+        if _track_memory and _running:
+            name, start_memory, peak = _running.pop()
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            stats['peak_bytes'] = max(stats['peak_bytes'], peak - start_memory)
+            if _running:
+                _running[-1][2] = max(_running[-1][2], peak)
+
+def get_report():
+    ''' Returns everything recorded so far.
+
+        Returns:
+            report (dict<str, dict>) : The total seconds, number of calls and peak memory
+                                       (in bytes above the memory in use when the stage
+                                       started) of each stage, by name.
+
+    '''
+    return {name: dict(stats) for name, stats in _stats.items()}
+
+def merge_report(report):
+    ''' Adds a report from get_report (e.g. from another process) to what has been
+        recorded here.
+
+        Parameters:
+            report (dict<str, dict>) : The report being added.
+
+    '''
+    for name, other in report.items():
+        stats = _stats.setdefault(name, {'seconds': 0, 'calls': 0, 'peak_bytes': 0})
+        stats['seconds'] += other['seconds']
+        stats['calls'] += other['calls']
+        stats['peak_bytes'] = max(stats['peak_bytes'], other['peak_bytes'])
+
+def format_report(report=None):
+    ''' Formats a report as a text table, with the slowest stages first.
+
+        Parameters:
+            report (dict<str, dict>) : A report from get_report (the current one if None).
+
+        Returns:
+            table (str) : The table.
+
+    '''
+    if report is None:
+        report = get_report()
+    lines = ['stage          seconds   calls     ms/call   peak MiB']
+    for name, stats in sorted(report.items(), key=lambda item: -item[1]['seconds']):
+        lines.append('{:<14} {:<9.3f} {:<9} {:<9.3f} {:.1f}'.format(
+            name, stats['seconds'], stats['calls'], 1000*stats['seconds']/max(stats['calls'], 1), stats['peak_bytes']/2**20))
+    return '\n'.join(lines)
+
+def save_report(filepath, report=None):
+    ''' Saves a report as JSON.
+
+        Parameters:
+            filepath (str) : Where the report is saved.
+            report (dict<str, dict>) : A report from get_report (the current one if None).
+
+    '''
+    if report is None:
+        report = get_report()
+    with open(filepath, 'w') as report_file:
+        json.dump(report, report_file, indent=4, sort_keys=True)
@@ -0,0 +1,190 @@
+import functools
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+def choose_rasterizer(complexity):
+    ''' Returns the faster GifCanvas rasterizer for planets of a given complexity.
+        rasterize costs about as much as filling the planet's disk (around 0.1s a frame
+        for a 500 pixel planet) however few faces there are, so PIL (drawing faces one
+        by one) is faster below complexity 6.
+
+        Parameters:
+            complexity (int) : The complexity of the planets being drawn.
+
+        Returns:
+            rasterizer (str) : 'pil' or 'numpy'.
+
+    '''
+    return 'numpy' if complexity >= 6 else 'pil'
+
+def rasterize(framebuffer, zbuffer, points, depths, colors, max_batch_pixels=2**22):
+    ''' Draws an array of triangles into a framebuffer, keeping the pixel closest to
+        the viewer (the highest z) using a z-buffer, so triangles can be drawn in any
+        order.
+
+        Triangles are batched by the size of their bounding box: every triangle in a
+        batch is tested against a tile of pixels of the same size starting at the
+        corner of its bounding box, so all of the triangles in a batch
+        are rasterized with a handful of array operations.
+
+        Parameters:
+            framebuffer (array<array<array<int>>>) : An (H, W, 3) uint8 array drawn into.
+            zbuffer (array<array<float>>) : An (H, W) array holding the depth of each pixel
+                                            (-inf where nothing has been drawn).
+            points (array<array<array<float, float>>>) : A (T, 3, 2) array of the x and y
+                                                          pixel coordinates of each corner.
+            depths (array<array<float>>) : A (T, 3) array of the z coordinate of each corner.
+            colors (array<array<int>>) : A (T, 3+) array of the triangles' colors.
+            max_batch_pixels (int) : The most pixels tested in one array operation.
+
+    '''
+    height, width = zbuffer.shape
+    points = np.asarray(points, dtype=np.float64)
+    depths = np.asarray(depths, dtype=np.float64)
+    colors = np.asarray(colors)
+
+    #The bounding box of every triangle, clipped to the canvas
+    xmin = np.maximum(np.ceil(points[:, :, 0].min(axis=1)), 0).astype(np.int64)
+    xmax = np.minimum(np.floor(points[:, :, 0].max(axis=1)), width - 1).astype(np.int64)
+    ymin = np.maximum(np.ceil(points[:, :, 1].min(axis=1)), 0).astype(np.int64)
+    ymax = np.minimum(np.floor(points[:, :, 1].max(axis=1)), height - 1).astype(np.int64)
+
+    #Barycentric weights are found from the signed area of each triangle
+    x0, y0 = points[:, 0, 0], points[:, 0, 1]
+    x1, y1 = points[:, 1, 0], points[:, 1, 1]
+    x2, y2 = points[:, 2, 0], points[:, 2, 1]
+    area = (x1 - x0)*(y2 - y0) - (x2 - x0)*(y1 - y0)
+    drawn = (xmax >= xmin) & (ymax >= ymin) & (area != 0)
+
+    #Group the triangles by the size of tile that covers their bounding box
+    tile_width = _tile_size(xmax - xmin + 1)
+    tile_height = _tile_size(ymax - ymin + 1)
+
+    pixel_batches, depth_batches, triangle_batches = [], [], []
+    for tw, th in set(zip(tile_width[drawn].tolist(), tile_height[drawn].tolist())):
+        triangles = np.flatnonzero(drawn & (tile_width == tw) & (tile_height == th))
+        offset_y, offset_x = np.divmod(np.arange(tw*th), tw)
+        step = max(1, max_batch_pixels // (tw*th))
+
+        for i in range(0, len(triangles), step):
+            t = triangles[i:i+step, None]
+            px = xmin[t] + offset_x
+            py = ymin[t] + offset_y
+
+            #Weights of the second and third corners; a pixel is inside the
+            #triangle (or on its edge) when all three weights are non-negative
+            w1 = ((px - x0[t])*(y2[t] - y0[t]) - (x2[t] - x0[t])*(py - y0[t]))/area[t]
+            w2 = ((x1[t] - x0[t])*(py - y0[t]) - (px - x0[t])*(y1[t] - y0[t]))/area[t]
+            w0 = 1 - w1 - w2
+            inside = (w0 >= -1e-9) & (w1 >= -1e-9) & (w2 >= -1e-9) & (px <= xmax[t]) & (py <= ymax[t])
+
+            depth = w0*depths[t, 0] + w1*depths[t, 1] + w2*depths[t, 2]
+            pixel_batches.append((py*width + px)[inside])
+            depth_batches.append(depth[inside])
+            triangle_batches.append(np.broadcast_to(t, inside.shape)[inside])
+
+    if not pixel_batches:
+        return
+
+    pixels = np.concatenate(pixel_batches)
+    depth = np.concatenate(depth_batches)
+    triangle = np.concatenate(triangle_batches)
+
+    #For every pixel keep only the sample closest to the viewer, and only
+    #if it is closer than whatever was drawn there before.
+    order = np.lexsort((depth, pixels))
+    pixels, depth, triangle = pixels[order], depth[order], triangle[order]
+    last = np.append(pixels[1:] != pixels[:-1], True)
+    pixels, depth, triangle = pixels[last], depth[last], triangle[last]
+
+    flat_zbuffer = zbuffer.reshape(-1)
+    closer = depth > flat_zbuffer[pixels]
+    pixels, depth, triangle = pixels[closer], depth[closer], triangle[closer]
+    flat_zbuffer[pixels] = depth
+    framebuffer.reshape(-1, framebuffer.shape[2])[pixels] = colors[triangle, :framebuffer.shape[2]]
+
+def _tile_size(values):
+    #Rounds sizes up to the next of 1, 2, 3, 4, 6, 8, 12, 16, 24, ... so that
+    #there are few batches while tiles are never much bigger than needed
+    values = np.maximum(values, 1)
+    power = 2**np.floor(np.log2(values))
+    return np.where(values <= power, power, np.where(values <= 1.5*power, 1.5*power, 2*power)).astype(np.int64)
+
+@functools.lru_cache(maxsize=8)
+def get_starfield(canvas_size, background_color, star_colors, star_min_size, star_max_size, seed):
+    ''' Returns the starfield drawn by draw_starfield, cached so canvases with the same
+        size, seed and star sizes share one starfield. Unseeded starfields should be
+        drawn with draw_starfield directly, as they are never asked for again.
+
+        Parameters:
+            canvas_size (tuple<int, int>) : The width and height of the canvas.
+            background_color (tuple<int, int, int, int>) : The color of the background.
+            star_colors (tuple<tuple<int, int, int, int>>) : The colors stars can have.
+            star_min_size (int) : The minimum star size in pixels wide.
+            star_max_size (int) : The maximum star size in pixels wide.
+            seed (int) : The seed used to place and color the stars.
+
+        Returns:
+            starfield (array<array<array<int>>>) : A read-only (H, W, 3) uint8 array.
+
+    '''
+    return draw_starfield(canvas_size, background_color, star_colors, star_min_size, star_max_size, seed)
+
+def draw_starfield(canvas_size, background_color, star_colors, star_min_size, star_max_size, seed):
+    ''' Draws a background of stars into an array. The stars are generated and drawn
+        with array operations.
+
+        Parameters:
+            canvas_size (tuple<int, int>) : The width and height of the canvas.
+            background_color (tuple<int, int, int, int>) : The color of the background.
+            star_colors (tuple<tuple<int, int, int, int>>) : The colors stars can have.
+            star_min_size (int) : The minimum star size in pixels wide.
+            star_max_size (int) : The maximum star size in pixels wide.
+            seed (int) : The seed used to place and color the stars.
+
+        Returns:
+            starfield (array<array<array<int>>>) : A read-only (H, W, 3) uint8 array.
+
+    '''
+    width, height = canvas_size
+    starfield = np.empty((height, width, 3), dtype=np.uint8)
+    starfield[:] = background_color[:3]
+
+    #Create a number of stars with a random star colour,
+    #opacity, position and size.
+    rng = np.random.default_rng(seed)
+    count = int(width*height/1000)
+    star_colors = np.asarray(star_colors, dtype=np.int64)
+    colors = star_colors[rng.integers(len(star_colors), size=count)]
+    alphas = (colors[:, 3]*rng.random(count)*0.5).astype(np.int64)
+    xcentres = rng.integers(width, size=count)
+    ycentres = rng.integers(height, size=count)
+    sizes = rng.integers(star_min_size, star_max_size + 1, size=count)
+
+    #Stars of the same size share a stencil, and each pixel of the stencil
+    #is blended into the starfield for all of those stars at once
+    for size in np.unique(sizes).tolist():
+        stars = sizes == size
+        offset_y, offset_x = _get_star_stencil(size)
+        for dy, dx in zip(offset_y.tolist(), offset_x.tolist()):
+            x, y = xcentres[stars] + dx, ycentres[stars] + dy
+            inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+            x, y = x[inside], y[inside]
+            alpha = alphas[stars][inside, None]
+            background = starfield[y, x].astype(np.int64)
+            #The same rounding as PIL uses when blending a translucent fill
+            blend = background*(255 - alpha) + colors[stars][inside, :3]*alpha + 128
+            starfield[y, x] = ((blend >> 8) + blend) >> 8
+
+    starfield.flags.writeable = False
+    return starfield
+
+@functools.lru_cache(maxsize=None)
+def _get_star_stencil(size):
+    #The pixels PIL fills for a star's ellipse, relative to its centre
+    half = -(-size//2)
+    stencil = Image.new('L', (2*half + 1, 2*half + 1))
+    ImageDraw.Draw(stencil).ellipse([0, 0, 2*half, 2*half], fill=255)
+    offset_y, offset_x = np.nonzero(np.asarray(stencil))
+    return offset_y - half, offset_x - half
@@ -1,6 +1,18 @@
-import random, math
+import math
+import functools
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
+#The number of threads noise is evaluated on, and the number of nodes each one is
+#given at a time (see map_chunks)
+_noise_workers = int(os.environ.get('ATLAS_NOISE_WORKERS', os.cpu_count() or 1))
+_noise_chunk_size = int(os.environ.get('ATLAS_NOISE_CHUNK_SIZE', 2**14))
+
+#The thread pool of map_chunks, as (process id, workers, executor)
+_noise_executor = None
+
 
 def change_distance(node, distance):
     ''' Changes the height of a node.
@@ -20,6 +32,21 @@ def change_distance(node, distance):
     newnode[2] = node[2]*distance_multiplier
     return newnode
 
+def change_distances(nodes, distances):
+    ''' Changes the height of an array of nodes at once.
+
+        Parameters:
+            nodes (array<array<float, float, float>>) : An (N, 3) array of nodes.
+            distances (float or array<float>) : The height(s) to which the nodes are being extended.
+
+        Returns:
+            newnodes (array<array<float, float, float>>) : The adjusted (N, 3) array of nodes.
+
+    '''
+    nodes = np.asarray(nodes, dtype=np.float64)
+    distance_multiplier = distances/get_heights(nodes)
+    return nodes*distance_multiplier[:, None]
+
 def get_height(node):
     ''' Calculates the height of a node, relative to the coordinates (0, 0, 0).
 
@@ -32,6 +59,59 @@ def get_height(node):
     '''
     return math.sqrt(node[0]**2 + node[1]**2 + node[2]**2)
 
+def get_heights(nodes):
+    ''' Calculates the height of an array of nodes, relative to the coordinates (0, 0, 0).
+
+        Parameters:
+            nodes (array<array<float, float, float>>) : An (N, 3) array of nodes.
+
+        Returns:
+            heights (array<float>) : The height of each node.
+
+    '''
+    nodes = np.asarray(nodes, dtype=np.float64)
+    return np.sqrt(nodes[:, 0]**2 + nodes[:, 1]**2 + nodes[:, 2]**2)
+
+def get_island_ratios(nodes, centres, sizes, max_batch=2**16):
+    ''' Calculates how close every node is to its nearest island, relative to the
+        island's size: the largest of 1 - distance/size over all islands, or 0 if
+        the node is outside every island. The distances are found as an (N, I)
+        matrix, in chunks of nodes so the matrix never holds more than [max_batch]
+        distances. Large arrays of nodes are split across threads (see map_chunks).
+
+        Parameters:
+            nodes (array<array<float, float, float>>) : An (N, 3) array of nodes.
+            centres (array<array<float, float, float>>) : An (I, 3) array of island centres.
+            sizes (array<float>) : The radius of each island.
+            max_batch (int) : The most distances calculated in one array operation.
+
+        Returns:
+            ratios (array<float>) : An (N,) array of values between 0 and 1.
+
+    '''
+    return map_chunks(_get_island_ratios, nodes, centres, sizes, max_batch)
+
+def _get_island_ratios(nodes, centres, sizes, max_batch):
+    nodes = np.asarray(nodes, dtype=np.float64)
+    centres = np.asarray(centres, dtype=np.float64).reshape(-1, 3)
+    sizes = np.asarray(sizes, dtype=np.float64)
+    ratios = np.zeros(len(nodes))
+    if len(centres) == 0:
+        return ratios
+
+    step = max(1, max_batch // len(centres))
+    for i in range(0, len(nodes), step):
+        chunk = nodes[i:i+step]
+        #Summing the axes one at a time avoids an (N, I, 3) array
+        distances = (chunk[:, 0, None] - centres[:, 0])**2
+        distances += (chunk[:, 1, None] - centres[:, 1])**2
+        distances += (chunk[:, 2, None] - centres[:, 2])**2
+        np.sqrt(distances, out=distances)
+        distances /= sizes
+        #1 - x is decreasing, so the closest island gives the largest ratio
+        np.maximum(1 - distances.min(axis=1), 0, out=ratios[i:i+step])
+    return ratios
+
 def get_middle_point(point1, point2, point3):
     ''' Calculates the point equidistant from three other points.
 
@@ -49,6 +129,286 @@ def get_middle_point(point1, point2, point3):
     newz = (point1[2] + point2[2] + point3[2]) / 3
     return [newx, newy, newz]
 
+def get_middle_points(nodes, faces):
+    ''' Calculates the centre point of every face at once.
+
+        Parameters:
+            nodes (array<array<float, float, float>>) : An (N, 3) array of nodes.
+            faces (array<array<int, int, int>>) : An (F, 3) array of node indexes.
+
+        Returns:
+            middlenodes (array<array<float, float, float>>) : An (F, 3) array of centre points.
+
+    '''
+    corners = np.asarray(nodes, dtype=np.float64)[np.asarray(faces)]
+    return (corners[:, 0] + corners[:, 1] + corners[:, 2]) / 3
+
+def get_edge_keys(faces, node_count):
+    ''' Gives every edge of every face a single integer key, which is the same
+        for two faces sharing that edge. The edges of each face are given in the
+        order (node1, node2), (node1, node3), (node2, node3).
+
+        Parameters:
+            faces (array<array<int, int, int>>) : An (F, 3) array of node indexes.
+            node_count (int) : The total number of nodes.
+
+        Returns:
+            keys (array<int>) : An (F, 3) array of edge keys.
+
+    '''
+    faces = np.asarray(faces, dtype=np.int64)
+    start = faces[:, [0, 0, 1]]
+    end = faces[:, [1, 2, 2]]
+    return np.minimum(start, end)*node_count + np.maximum(start, end)
+
+def get_vertex_adjacency(faces, node_count):
+    ''' Finds the neighbouring nodes of every node.
+
+        Parameters:
+            faces (array<array<int, int, int>>) : An (F, 3) array of node indexes.
+            node_count (int) : The total number of nodes.
+
+        Returns:
+            neighbours (list<array<int>>) : The sorted neighbours of each node.
+
+    '''
+    keys = np.unique(get_edge_keys(faces, node_count))
+    start, end = keys // node_count, keys % node_count
+    source = np.concatenate((start, end))
+    target = np.concatenate((end, start))
+    order = np.lexsort((target, source))
+    splits = np.cumsum(np.bincount(source, minlength=node_count))[:-1]
+    return np.split(target[order], splits)
+
+def get_face_adjacency(faces, node_count):
+    ''' Finds the face across each edge of every face. Edges that are not
+        shared with another face (i.e. the mesh is not watertight) are given -1.
+
+        Parameters:
+            faces (array<array<int, int, int>>) : An (F, 3) array of node indexes.
+            node_count (int) : The total number of nodes.
+
+        Returns:
+            neighbours (array<array<int, int, int>>) : An (F, 3) array of face indexes,
+                                                        in the same edge order as get_edge_keys.
+
+    '''
+    keys = get_edge_keys(faces, node_count).ravel()
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    neighbours = np.full(len(keys), -1, dtype=np.int64)
+    pairs = np.flatnonzero(sorted_keys[1:] == sorted_keys[:-1])
+    neighbours[order[pairs]] = order[pairs + 1] // 3
+    neighbours[order[pairs + 1]] = order[pairs] // 3
+    return neighbours.reshape(-1, 3)
+
+def get_icosahedron_nodes():
+    ''' Defines the 12 nodes of a unit icosahedron.
+
+        Returns:
+            nodes (array<array<float, float, float>>) : A (12, 3) array of nodes.
+
+    '''
+    a = 1 / math.sqrt(11 + 2*math.sqrt(5))
+    phi = a * (1 + math.sqrt(5))/2
+    nodes = [[0, -a, -phi],
+             [0, -a, phi],
+             [0, a, -phi],
+             [0, a, phi],
+             [-a, -phi, 0],
+             [-a, phi, 0],
+             [a, -phi, 0],
+             [a, phi, 0],
+             [-phi, 0, -a],
+             [phi, 0, -a],
+             [-phi, 0, a],
+             [phi, 0, a]]
+    return change_distances(nodes, 1)
+
+def get_icosahedron_faces():
+    ''' Defines the 20 faces of an icosahedron.
+
+        Returns:
+            faces (array<array<int, int, int>>) : A (20, 3) array of node indexes.
+
+    '''
+    return np.array([[0, 2, 8],
+                     [0, 2, 9],
+                     [1, 3, 10],
+                     [1, 3, 11],
+                     [0, 4, 6],
+                     [1, 4, 6],
+                     [2, 5, 7],
+                     [3, 5, 7],
+                     [4, 8, 10],
+                     [5, 8, 10],
+                     [6, 9, 11],
+                     [7, 9, 11],
+                     [0, 4, 8],
+                     [0, 6, 9],
+                     [1, 4, 10],
+                     [1, 6, 11],
+                     [2, 5, 8],
+                     [2, 7, 9],
+                     [3, 5, 10],
+                     [3, 7, 11]], dtype=np.int32)
+
+def subdivide(nodes, faces, radius, shared_edges=True):
+    ''' Subdivides every face of a sphere once. Face i is split into the faces
+        4i to 4i+3, the last of which is the centre face.
+
+        Parameters:
+            nodes (array<array<float, float, float>>) : An (N, 3) array of nodes.
+            faces (array<array<int, int, int>>) : An (F, 3) array of node indexes.
+            radius (float) : The radius of the sphere new nodes are pushed out to.
+            shared_edges (boolean) : If True, the midpoint of an edge is only added once
+                                     and shared by both faces on that edge. If False,
+                                     every face adds its own three midpoints.
+
+        Returns:
+            nodes (array<array<float, float, float>>) : The nodes, followed by the new midpoints.
+            faces (array<array<int, int, int>>) : A (4F, 3) array of node indexes.
+
+    '''
+    nodelength = len(nodes)
+
+    #When subdividing the grid, each face is split into 4 other faces.
+    #This means that an extra 3 nodes are needed; each node is inbetween
+    #two other nodes.
+    if shared_edges:
+        #Every edge is only split once; the edge keys map each edge of
+        #each face to the index of its (single) midpoint.
+        edge_keys = get_edge_keys(faces, nodelength)
+        unique_keys, edge_map = np.unique(edge_keys, return_inverse=True)
+        node1, node2 = nodes[unique_keys // nodelength], nodes[unique_keys % nodelength]
+        midnodes = node1/2 + node2/2
+        newnodenums = nodelength + edge_map.reshape(-1, 3).astype(np.int32)
+    else:
+        #For each combination of nodes in each face, create a node that is
+        #directly inbetween those two nodes,
+        node1, node2, node3 = nodes[faces[:, 0]], nodes[faces[:, 1]], nodes[faces[:, 2]]
+        midnodes = np.stack((node1/2 + node2/2, node1/2 + node3/2, node2/2 + node3/2), axis=1).reshape(-1, 3)
+        newnodenums = nodelength + np.arange(len(faces)*3, dtype=np.int32).reshape(-1, 3)
+
+    #And add it to the existing nodes
+    nodes = np.concatenate((nodes, change_distances(midnodes, radius)))
+
+    #Take the indexes of the new nodes that were just added to each face.
+    newnodenum1, newnodenum2, newnodenum3 = newnodenums[:, 0], newnodenums[:, 1], newnodenums[:, 2]
+    node1num, node2num, node3num = faces[:, 0], faces[:, 1], faces[:, 2]
+
+    #And add 4 new faces such that each face is the combination
+    #of two new nodes and the node that was used to make both
+    #of them.
+    new_faces = np.stack((np.stack((node1num, newnodenum1, newnodenum2), axis=1),
+                          np.stack((node2num, newnodenum1, newnodenum3), axis=1),
+                          np.stack((node3num, newnodenum2, newnodenum3), axis=1),
+                          np.stack((newnodenum1, newnodenum2, newnodenum3), axis=1)), axis=1)
+
+    return nodes, new_faces.reshape(-1, 3).astype(np.int32)
+
+def rotation_matrix(plane, angle):
+    ''' Returns the matrix rotating nodes by an angle within a plane, such that
+        for the plane 'xz', x' = cos*x - sin*z and z' = sin*x + cos*z.
+        Rotations are combined by multiplying their matrices, and applied to an
+        (N, 3) array of nodes with nodes @ matrix.T.
+
+        Parameters:
+            plane (str) : The plane of rotation ('xy', 'xz' or 'yz').
+            angle (float) : The angle of rotation in degrees.
+
+        Returns:
+            matrix (array<array<float>>) : A 3x3 rotation matrix.
+
+    '''
+    first, second = 'xyz'.index(plane[0]), 'xyz'.index(plane[1])
+    cosTheta = math.cos(math.radians(angle))
+    sinTheta = math.sin(math.radians(angle))
+    matrix = np.identity(3)
+    matrix[first, first] = cosTheta
+    matrix[first, second] = -sinTheta
+    matrix[second, first] = sinTheta
+    matrix[second, second] = cosTheta
+    return matrix
+
+
+def set_noise_threads(workers=None, chunk_size=None):
+    ''' Sets how noise is split across threads (see map_chunks). The defaults come
+        from the ATLAS_NOISE_WORKERS and ATLAS_NOISE_CHUNK_SIZE environment variables,
+        or the number of CPUs and 16384 nodes.
+
+        Parameters:
+            workers (int) : The number of threads (1 evaluates noise on the calling
+                            thread). Unchanged if None.
+            chunk_size (int) : The number of nodes in each chunk. Unchanged if None.
+
+    '''
+    global _noise_workers, _noise_chunk_size
+    if workers is not None:
+        _noise_workers = max(1, int(workers))
+    if chunk_size is not None:
+        _noise_chunk_size = max(1, int(chunk_size))
+
+def get_noise_executor():
+    ''' Returns the thread pool noise chunks are evaluated on, starting a new one if
+        the number of workers changed or the process was forked since.
+
+    '''
+    global _noise_executor
+    if _noise_executor is None or _noise_executor[:2] != (os.getpid(), _noise_workers):
+        if _noise_executor is not None and _noise_executor[0] == os.getpid():
+            _noise_executor[2].shutdown(wait=False)
+        _noise_executor = (os.getpid(), _noise_workers,
+                           ThreadPoolExecutor(_noise_workers, thread_name_prefix='atlas-noise'))
+    return _noise_executor[2]
+
+def shutdown_noise_executor():
+    ''' Stops the threads of the noise thread pool, e.g. before the process forks (a
+        new pool is started the next time noise is evaluated).
+
+    '''
+    global _noise_executor
+    if _noise_executor is not None and _noise_executor[0] == os.getpid():
+        _noise_executor[2].shutdown(wait=True)
+    _noise_executor = None
+
+def map_chunks(function, nodes, *args, chunk_size=None):
+    ''' Evaluates an elementwise function of an array of nodes in chunks on a pool of
+        threads. Numpy releases the GIL inside its array operations, so the chunks
+        run on separate cores. Chunks are whole multiples of 64 nodes, so every node
+        goes through the same vectorized loops as it would in one pass, and the
+        result is identical to function(nodes, *args).
+
+        Parameters:
+            function (function) : Takes an (n, 3) array of nodes and [args] and returns
+                                  an (n,) array.
+            nodes (array<array<float, float, float>>) : An (N, 3) array of nodes.
+            args : Any other arguments of the function.
+            chunk_size (int) : The number of nodes in each chunk (the size set by
+                               set_noise_threads if None).
+
+        Returns:
+            values (array<float>) : The (N,) array the function gives for the nodes.
+
+    '''
+    nodes = np.asarray(nodes, dtype=np.float64)
+    if chunk_size is None:
+        chunk_size = _noise_chunk_size
+    chunk_size = -(-chunk_size // 64)*64
+    if len(nodes) <= chunk_size:
+        return function(nodes, *args)
+
+    values = np.empty(len(nodes))
+    def evaluate(start):
+        values[start:start+chunk_size] = function(nodes[start:start+chunk_size], *args)
+    starts = range(0, len(nodes), chunk_size)
+    if _noise_workers <= 1:
+        #Chunks are still used, so the temporary arrays stay small
+        for start in starts:
+            evaluate(start)
+    else:
+        list(get_noise_executor().map(evaluate, starts))
+    return values
 
 ##Perlin noise
 def lerp(a0, a1, w):
@@ -56,84 +416,245 @@ def lerp(a0, a1, w):
         comment remind me to find out and update the comment
     '''
     return (1 - w)*a0 + w*a1
- 
-def dotGridGradient(ix, iy, iz, x, y, z, random_hash):
-    ''' Calculates a random directional vector for a point, and then
-        returns the dot product between that vector and the vector between
-        that point and a rounded point.
-
-        Parameters:
-            ix (float) : The rounded point's x value.
-            iy (float) : The rounded point's y value.
-            iz (float) : The rounded point's z value.
-            x (float) : The initial point's x value.
-            y (float) : The initial point's y value.
-            z (float) : The initial point's z value.
-            random_hash (str) : A random hash used to seed the random
+
+def stable_hash(*values):
+    ''' Hashes values into a 64 bit integer which, unlike hash(), is the same in
+        every process and every run (string hashes are salted per process).
+
+        Parameters:
+            values : Any values with a stable repr (e.g. strings, numbers).
+
+        Returns:
+            value_hash (int) : An integer between 0 and 2^64 - 1.
+
+    '''
+    digest = hashlib.blake2b(repr(values).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+def get_generator(*values):
+    ''' Returns a numpy random generator seeded from the stable hash of the values,
+        so that every (seed, stream name) pair gets its own independent stream.
+
+        Parameters:
+            values : Any values with a stable repr (e.g. a seed and a stream name).
+
+        Returns:
+            generator (Generator) : A numpy random generator.
+
+    '''
+    return np.random.default_rng([stable_hash(value) for value in values])
+
+def splitmix64(values):
+    ''' Scrambles an array of 64 bit integers with the splitmix64 finalizer, so that
+        neighbouring inputs give unrelated outputs.
+
+        Parameters:
+            values (array<uint64>) : The integers being scrambled.
+
+        Returns:
+            scrambled (array<uint64>) : The scrambled integers.
+
+    '''
+    #The first addition copies the values, and the rest is done in place
+    values = values + np.uint64(0x9E3779B97F4A7C15)
+    values ^= values >> np.uint64(30)
+    values *= np.uint64(0xBF58476D1CE4E5B9)
+    values ^= values >> np.uint64(27)
+    values *= np.uint64(0x94D049BB133111EB)
+    values ^= values >> np.uint64(31)
+    return values
+
+@functools.lru_cache(maxsize=64)
+def get_gradient_table(random_hash, size=256):
+    ''' Builds the table of random directional vectors that lattice points of the
+        noise grid pick from. The table only depends on the hash, so it is built
+        once and reused.
+
+        Parameters:
+            random_hash (int) : A random hash used to seed the random
                                 generator.
+            size (int) : The number of vectors (a power of two).
+
+        Returns:
+            gradients (array<array<float, float, float>>) : [size] random unit vectors.
+
+    '''
+    generator = np.random.default_rng(random_hash & 0xFFFFFFFFFFFFFFFF)
+    theta = 2*np.pi*generator.random(size)
+    randz = 2*generator.random(size) - 1
+    randy = np.sqrt(1 - randz**2)*np.sin(theta)
+    randx = np.sqrt(1 - randz**2)*np.cos(theta)
+    gradients = np.stack((randy, randx, randz), axis=1)
+
+    gradients.flags.writeable = False
+    return gradients
+
+@functools.lru_cache(maxsize=64)
+def get_gradient_tables(random_hashes):
+    ''' Stacks the gradient tables of several hashes, one per octave of noise, as one
+        table per axis so each axis can be looked up with a single take.
+
+        Parameters:
+            random_hashes (tuple<int>) : The hash of each octave.
+
+        Returns:
+            gradients (array<array<float>>) : A (3, O*256) array, where the gradients of
+                                              octave o start at column o*256.
+
+    '''
+    gradients = np.concatenate([get_gradient_table(random_hash) for random_hash in random_hashes])
+    gradients = np.ascontiguousarray(gradients.T)
+    gradients.flags.writeable = False
+    return gradients
+
+def get_lattice_hashes(ix, iy, iz, random_hash):
+    ''' Hashes arrays of lattice points into random 64 bit integers. The hash only
+        depends on the point and [random_hash] (it is counter-based, with no table
+        or generator state), so it is the same in every process and never repeats
+        along an axis.
+
+        Parameters:
+            ix (array<int>) : The points' x values.
+            iy (array<int>) : The points' y values.
+            iz (array<int>) : The points' z values.
+            random_hash (int or array<uint64>) : A random hash used to seed the hash, or
+                                                 an array of them broadcast against the
+                                                 points (e.g. one per octave).
 
         Returns:
-            dot_product (float) : The end product of the two vectors.
+            lattice_hashes (array<uint64>) : A hash for every point.
 
     '''
-    combined_hash = hash(((ix, iy, iz), random_hash))
-    random.seed(combined_hash)
+    if isinstance(random_hash, int):
+        random_hash = np.uint64(random_hash & 0xFFFFFFFFFFFFFFFF)
+    #Large odd multipliers spread each axis across all 64 bits before mixing.
+    #Viewing the int64 values as uint64 keeps their bits without a copy.
+    key = _as_uint64(ix)*np.uint64(0x8CB92BA72F3D8DD7)
+    key ^= _as_uint64(iy)*np.uint64(0xD6E8FEB86659FD93)
+    key ^= _as_uint64(iz)*np.uint64(0xA0761D6478BD642F)
+    key ^= random_hash
+    return splitmix64(key)
+
+def _as_uint64(values):
+    if values.dtype == np.int64:
+        return values.view(np.uint64)
+    return values.astype(np.uint64)
+
+def dotGridGradient(ix, iy, iz, x, y, z, random_hashes):
+    ''' Looks up the random directional vector for an array of lattice
+        points, and then returns the dot product between that vector and
+        the vector between that point and a rounded point. Each row of the
+        arrays is an octave of noise with its own hash.
 
-    theta = 2*math.pi*random.random()
-    randz = 2*random.random()-1
-    randy = math.sqrt(1-randz**2)*math.sin(theta)
-    randx = math.sqrt(1-randz**2)*math.cos(theta)
+        Parameters:
+            ix (array<array<int>>) : The rounded points' x values.
+            iy (array<array<int>>) : The rounded points' y values.
+            iz (array<array<int>>) : The rounded points' z values.
+            x (array<array<float>>) : The initial points' x values.
+            y (array<array<float>>) : The initial points' y values.
+            z (array<array<float>>) : The initial points' z values.
+            random_hashes (tuple<int>) : The random hash of each row.
+
+        Returns:
+            dot_product (array<array<float>>) : The end product of the two vectors.
+
+    '''
+    gradients = get_gradient_tables(random_hashes)
+    keys = np.array([random_hash & 0xFFFFFFFFFFFFFFFF for random_hash in random_hashes], dtype=np.uint64)
+    index = (get_lattice_hashes(ix, iy, iz, keys[:, None]) >> np.uint64(56)).astype(np.intp)
+    #Each row picks from its own table of 256 gradients
+    index += np.arange(0, gradients.shape[1], 256)[:, None]
 
     dx = x - ix
     dy = y - iy
     dz = z - iz
 
-    return (dz*randz + dx*randy + dy*randx)
+    return (dx*gradients[0].take(index) + dy*gradients[1].take(index) + dz*gradients[2].take(index))
 
-def perlin(node, period, amplitude, random_hash, uniform=True):
-    ''' Generates perlin noise for a given node.
+def perlin_array(nodes, period, amplitude, random_hash, uniform=True):
+    ''' Generates perlin noise for an array of nodes at once.
 
         Parameters:
-            node (array<float, float, float>) : An arbitrary node.
+            nodes (array<array<float, float, float>>) : An (N, 3) array of nodes.
             period (float) : How spread out randomness is i.e. how smoothed out?
             amplitude (float) : How extreme values can be i.e. how high?
-            random_hash (str) : A hash used to seed the random generator.
-            normalise (boolean) : Determines whether the returned values are normally
+            random_hash (int) : A hash used to seed the random generator.
+            uniform (boolean) : Determines whether the returned values are normally
                                     or uniformly distributed.
 
         Returns:
-            noise (float) : A random value between 0 and [amplitude].
+            noise (array<float>) : N random values between 0 and [amplitude].
 
     '''
-    x = node[0]/period
-    y = node[1]/period
-    z = node[2]/period
+    return map_chunks(_perlin_array, nodes, period, amplitude, random_hash, uniform)
+
+def _perlin_array(nodes, period, amplitude, random_hash, uniform):
+    return _perlin_octaves(nodes, (period,), amplitude, (random_hash,), uniform)[0]
+
+def fbm_array(nodes, octaves, amplitude, random_hashes, uniform=True):
+    ''' Generates fractal noise for an array of nodes at once: the weighted sum of
+        several octaves of perlin noise. Every octave is evaluated in the same pass
+        over the nodes (as rows of (O, N) arrays), so the cost grows about linearly
+        with the number of octaves.
 
-    x0 = math.floor(x)
+        Parameters:
+            nodes (array<array<float, float, float>>) : An (N, 3) array of nodes.
+            octaves (list<tuple<float, float>>) : The period and weight of each octave.
+            amplitude (float) : How extreme the values of each octave can be.
+            random_hashes (list<int>) : The hash of each octave.
+            uniform (boolean) : Determines whether the values of each octave are
+                                normally or uniformly distributed.
+
+        Returns:
+            noise (array<float>) : N random values between 0 and [amplitude] times
+                                   the sum of the weights.
+
+    '''
+    periods = tuple(float(period) for period, weight in octaves)
+    weights = np.array([weight for period, weight in octaves], dtype=np.float64)
+    if len(random_hashes) != len(periods):
+        raise ValueError('Expected {} octave hashes, got {}'.format(len(periods), len(random_hashes)))
+    #Every node has a value for each octave, so chunks hold fewer nodes to keep the
+    #arrays of each chunk the same size as with a single octave
+    return map_chunks(_fbm_array, nodes, periods, weights, amplitude, tuple(random_hashes), uniform,
+                      chunk_size=max(1, _noise_chunk_size // len(periods)))
+
+def _fbm_array(nodes, periods, weights, amplitude, random_hashes, uniform):
+    #Rows are added in order, so the sum is the same as adding the octaves one by one
+    return (weights[:, None]*_perlin_octaves(nodes, periods, amplitude, random_hashes, uniform)).sum(axis=0)
+
+def _perlin_octaves(nodes, periods, amplitude, random_hashes, uniform):
+    nodes = np.asarray(nodes, dtype=np.float64)
+    periods = np.asarray(periods, dtype=np.float64)[:, None]
+    x = nodes[:, 0]/periods
+    y = nodes[:, 1]/periods
+    z = nodes[:, 2]/periods
+
+    x0 = np.floor(x).astype(np.int64)
     x1 = x0 + 1
-    y0 = math.floor(y)
+    y0 = np.floor(y).astype(np.int64)
     y1 = y0 + 1
-    z0 = math.floor(z)
+    z0 = np.floor(z).astype(np.int64)
     z1 = z0 + 1
 
     sx = 3*(x-x0)**2 - 2*(x-x0)**3
     sy = 3*(y-y0)**2 - 2*(y-y0)**3
     sz = 3*(z-z0)**2 - 2*(z-z0)**3
 
-    n0 = dotGridGradient(x0, y0, z0, x, y, z, random_hash)
-    n1 = dotGridGradient(x1, y0, z0, x, y, z, random_hash)
+    n0 = dotGridGradient(x0, y0, z0, x, y, z, random_hashes)
+    n1 = dotGridGradient(x1, y0, z0, x, y, z, random_hashes)
     ix0 = lerp(n0, n1, sx)
-    n0 = dotGridGradient(x0, y1, z0, x, y, z, random_hash)
-    n1 = dotGridGradient(x1, y1, z0, x, y, z, random_hash)
+    n0 = dotGridGradient(x0, y1, z0, x, y, z, random_hashes)
+    n1 = dotGridGradient(x1, y1, z0, x, y, z, random_hashes)
     ix1 = lerp(n0, n1, sx)
 
-    n0 = dotGridGradient(x0, y0, z1, x, y, z, random_hash)
-    n1 = dotGridGradient(x1, y0, z1, x, y, z, random_hash)
+    n0 = dotGridGradient(x0, y0, z1, x, y, z, random_hashes)
+    n1 = dotGridGradient(x1, y0, z1, x, y, z, random_hashes)
     ix2 = lerp(n0, n1, sx)
-    n0 = dotGridGradient(x0, y1, z1, x, y, z, random_hash)
-    n1 = dotGridGradient(x1, y1, z1, x, y, z, random_hash)
+    n0 = dotGridGradient(x0, y1, z1, x, y, z, random_hashes)
+    n1 = dotGridGradient(x1, y1, z1, x, y, z, random_hashes)
     ix3 = lerp(n0, n1, sx)
-    
+
     ix4 = lerp(ix0, ix1, sy)
     ix5 = lerp(ix2, ix3, sy)
 
@@ -146,10 +667,27 @@ def perlin(node, period, amplitude, random_hash, uniform=True):
 
         # A function that approximates the cumulative frequency function
         # More here: https://www.hindawi.com/journals/mpe/2012/124029/
-        cmdf = 0.5* math.tanh(179*sd/23 - 111/2*math.atan(37*sd/294)) + 0.5
+        cmdf = 0.5* np.tanh(179*sd/23 - 111/2*np.arctan(37*sd/294)) + 0.5
         return amplitude*cmdf
 
     return 0.5*amplitude*(value + 1)
+
+def perlin(node, period, amplitude, random_hash, uniform=True):
+    ''' Generates perlin noise for a given node.
+
+        Parameters:
+            node (array<float, float, float>) : An arbitrary node.
+            period (float) : How spread out randomness is i.e. how smoothed out?
+            amplitude (float) : How extreme values can be i.e. how high?
+            random_hash (int) : A hash used to seed the random generator.
+            uniform (boolean) : Determines whether the returned values are normally
+                                    or uniformly distributed.
+
+        Returns:
+            noise (float) : A random value between 0 and [amplitude].
+
+    '''
+    return float(perlin_array([node], period, amplitude, random_hash, uniform)[0])
 ##end of perlin noise
 
 
@@ -246,3 +784,71 @@ def lighting(node1, node2, node3, color, light, attr):
         
         
     
+def get_normals(nodes, faces):
+    ''' Calculates the outward unit normal of every face at once, i.e. the same
+        vector as crossproduct, flipped where it would point into the planet.
+
+        Parameters:
+            nodes (array<array<float, float, float>>) : An (N, 3) array of nodes.
+            faces (array<array<int, int, int>>) : An (F, 3) array of node indexes.
+
+        Returns:
+            normals (array<array<float, float, float>>) : An (F, 3) array of unit normals.
+
+    '''
+    corners = np.asarray(nodes, dtype=np.float64)[np.asarray(faces)]
+    node1, node2, node3 = corners[:, 0], corners[:, 1], corners[:, 2]
+
+    normals = np.cross(node2 - node1, node3 - node1)
+    normals /= get_heights(normals)[:, None]
+    inwards = get_heights(node1) > get_heights(node1 + normals)
+    normals[inwards] = -normals[inwards]
+    return normals
+
+def lighting_array(nodes, faces, colors, light, attr, normals=None, depths=None):
+    '''Calculates how much light is being cast onto every face at once, using the same
+        ambient, diffuse and fog terms as lighting.
+
+        Parameters:
+            nodes (array<array<float, float, float>>) : An (N, 3) array of nodes.
+            faces (array<array<int, int, int>>) : An (F, 3) array of node indexes.
+            colors (array<array<int, int, int, int>>) : An (F, 4) array of face colors.
+            light (array<float, float, float>) : The direction light is coming from.
+            attr (dict) : The planet's attributes (uses 'atmosphere' for the fog).
+            normals (array<array<float, float, float>>) : The faces' unit normals, if
+                                                          already known (see get_normals).
+            depths (array<float>) : The z coordinate of the faces' centres, if already known.
+
+        Returns:
+            colors (array<array<int, int, int, int>>) : An (F, 4) uint8 array of the new colors.
+    '''
+    if normals is None:
+        normals = get_normals(nodes, faces)
+    avg_z = depths
+    if avg_z is None:
+        avg_z = np.asarray(nodes, dtype=np.float64)[np.asarray(faces), 2].sum(axis=1)/3
+
+    diffuse = np.maximum(0, normals @ np.asarray(light, dtype=np.float64))
+    return shade_colors(colors, diffuse, avg_z, attr['atmosphere'])
+
+def shade_colors(colors, diffuse, avg_z, fog_mod):
+    '''Applies the ambient, diffuse and fog terms of lighting to an array of colors.
+
+        Parameters:
+            colors (array<array<int, int, int, int>>) : An (F, 4) array of colors.
+            diffuse (array<float>) : How directly each face faces the light (>= 0).
+            avg_z (array<float>) : The z coordinate of the middle of each face.
+            fog_mod (float) : The thickness of the atmosphere.
+
+        Returns:
+            colors (array<array<int, int, int, int>>) : An (F, 4) uint8 array of the new colors.
+    '''
+    colors = np.asarray(colors, dtype=np.float64)
+    new_colors = (0.6 + 0.4*np.asarray(diffuse))[:, None]*colors
+
+    fog_p = np.exp(-((260-np.asarray(avg_z))/260)*fog_mod)[:, None]
+    new_colors = fog_p*new_colors + (1-fog_p)*255
+
+    new_colors = np.clip(np.trunc(new_colors), 0, 255).astype(np.uint8)
+    new_colors[:, 3] = 255
+    return new_colors
@@ -1,5 +1,5 @@
 import planet_support as ps
-import random, math
+import numpy as np
 
 class BodySetting(object):
     ''' Abstract class containing all the values that a planet requires.
@@ -7,7 +7,7 @@ class BodySetting(object):
             - Moisture
                 ~ (mh)
             - Terrain elevation
-                ~ (tlh, tmh, tsh)
+                ~ (terrain_hashes, one for each octave)
             - Clouds (optional)
                 ~ (ch)
                 
@@ -17,8 +17,7 @@ class BodySetting(object):
             - Diameter
                 ~ (diameter)
             - Values dictating how terrain is generated
-                ~ (large_noise_weight, medium_noise_weight, small_noise_weight)
-                ~ (large_noise_width, medium_noise_width, small_noise_width)
+                ~ (noise_octaves, the width and weight of each octave)
                 ~ (amplitude)
                 ~ (max_height, min_height)
             - Values dictating how moisture is generated
@@ -45,79 +44,139 @@ class BodySetting(object):
         return self._attr
 
     def set_hashes(self):
-        ''' Sets the hashes that are used for random generation of terrain,
-            moisture and clouds if applicable.
+        ''' Sets the hashes that are used for random generation of moisture and
+            clouds if applicable. They are drawn from the planet's own 'hashes'
+            stream, so they are the same in every process.
         '''
-        random.seed(self._seed)
-        self._mh = hash(random.random())
-        #moisture hash
-        self._tlh = hash(random.random())
-        #terrain large hash
-        self._tmh = hash(random.random())
-        #terrain medium hash
-        self._tsh = hash(random.random())
-        #terrain small hash
+        hashes = self.get_hashes(5)
+        self._mh = hashes[0]
+        self._ch = hashes[4]
 
-        if self._clouds_boolean:
-            self._ch = hash(random.random())
+    def get_hashes(self, count):
+        ''' Returns the first [count] hashes of the planet's 'hashes' stream. Each hash
+            is the same however many are asked for.
+        '''
+        generator = self.get_generator('hashes')
+        return [int(value) for value in generator.integers(2**63, size=count)]
+
+    def get_terrain_hashes(self):
+        ''' Returns a hash for each of the planet's terrain noise octaves, so a type
+            only has to set _noise_octaves to add more of them.
+        '''
+        #The moisture hash, the hashes of the first three terrain octaves, the cloud
+        #hash, and then the hashes of any further terrain octaves
+        octaves = len(self._noise_octaves)
+        hashes = self.get_hashes(2 + max(3, octaves))
+        return (hashes[1:4] + hashes[5:])[:octaves]
+
+    def get_generator(self, stream):
+        ''' Returns a new random generator for one named stream of the planet (e.g.
+            'islands' or 'rotation'). Streams are independent of each other and of
+            the global random state, and depend only on the seed and the name.
+        '''
+        return ps.get_generator(self._seed, stream)
 
     def get_diameter(self):
         return self._diameter
+
+    def get_colors(self):
+        ''' Returns every color a face of the body can have before lighting:
+            the biome colors and the cloud color (if applicable).
+        '''
+        colors = list(self._biome_dict.values())
+        if self._clouds_boolean:
+            colors.append(self._cloud_color)
+        return colors
     
     def get_biome_color(self, elevation, moisture):
         return self._biome_dict[self._biome_assignments.get((elevation, moisture), self._biome_other)]
 
     def get_terrain_noise(self, node, island_array):
-        large_noise = ps.perlin(node, self._large_noise_width, self._amplitude, self._tlh)
-        med_noise = ps.perlin(node, self._medium_noise_width, self._amplitude, self._tmh)
-        small_noise = ps.perlin(node, self._small_noise_width, self._amplitude, self._tsh)
-        
-        lnd, mnd, snd = self._large_noise_weight, self._medium_noise_weight, self._small_noise_weight
-        noise = (lnd*large_noise + mnd*med_noise + snd*small_noise)
+        return float(self.get_terrain_noise_array([node], island_array)[0])
+
+    def get_terrain_noise_array(self, nodes, island_array):
+        nodes = np.asarray(nodes, dtype=np.float64)
+        noise = ps.fbm_array(nodes, self._noise_octaves, self._amplitude, self.get_terrain_hashes())
 
         if self._islands_boolean:
-            min_dist_ratio = 0
-            for island in island_array:
-                    island_size = island[1]
-                    dist_from_mountain = math.sqrt((node[0]-island[0][0])**2 + (node[1]-island[0][1])**2 + (node[2]-island[0][2])**2)
-                    dist_ratio = 1 - dist_from_mountain/island_size
-                    if dist_ratio > min_dist_ratio:
-                        min_dist_ratio = dist_ratio
-            noise = noise - self._amplitude*(lnd + mnd + snd)*(1-min_dist_ratio)
-            if noise < 0:
-                return 0
-            else:
-                return noise
+            centres = [island[0] for island in island_array]
+            sizes = [island[1] for island in island_array]
+            min_dist_ratio = ps.get_island_ratios(nodes, centres, sizes)
+            total_weight = sum(weight for width, weight in self._noise_octaves)
+            noise = noise - self._amplitude*total_weight*(1-min_dist_ratio)
+            return np.maximum(noise, 0)
         return noise
 
     def get_moisture_noise(self, node):
-        noise = ps.perlin(node, self._moisture_noise_width, self._total_moisture_levels, self._mh)
-        try:
-            altitude = abs(math.asin(2*node[1]/self._diameter))
-        except:
-            altitude = 1
+        return float(self.get_moisture_noise_array([node])[0])
+
+    def get_moisture_noise_array(self, nodes):
+        nodes = np.asarray(nodes, dtype=np.float64)
+        noise = ps.perlin_array(nodes, self._moisture_noise_width, self._total_moisture_levels, self._mh)
+        #Nodes above the planet's radius at the poles are outside the domain of
+        #arcsin, and are treated as being at the poles (altitude 1)
+        latitude = 2*nodes[:, 1]/self._diameter
+        in_range = np.abs(latitude) <= 1
+        altitude = np.where(in_range, np.abs(np.arcsin(np.clip(latitude, -1, 1))), 1)
 
         noise = (self._total_moisture_levels - 1)*noise*altitude**2/self._total_moisture_levels + altitude
-            
-            
-        if noise > self._total_moisture_levels:
-            noise = self._total_moisture_levels
-        return noise
+        return np.minimum(noise, self._total_moisture_levels)
 
     def get_biome(self, node):
-        height = ps.get_height(node)
-        moisture_level = math.ceil(self.get_moisture_noise(node))
-        elevation_level = math.ceil(self._total_elevation_levels*(height-self._min_height)/self._height_range)
-        
-        return self.get_biome_color(elevation_level, moisture_level)
+        return tuple(self.get_biome_array([node])[0].tolist())
+
+    def get_biome_array(self, nodes, heights=None):
+        ''' Returns the biome color at every node (usually face centres), as a (N, 4)
+            uint8 array. The heights of the nodes can be passed in if they are known.
+        '''
+        nodes = np.asarray(nodes, dtype=np.float64)
+        if heights is None:
+            heights = ps.get_heights(nodes)
+        moisture_levels = np.ceil(self.get_moisture_noise_array(nodes)).astype(int)
+        elevation_levels = np.ceil(self._total_elevation_levels*(heights-self._min_height)/self._height_range).astype(int)
+        return self.get_biome_colors(elevation_levels, moisture_levels)
+
+    def get_biome_colors(self, elevation_levels, moisture_levels):
+        ''' Returns the color of every (elevation level, moisture level) pair as a (N, 4)
+            uint8 array, with a single lookup into the biome table.
+        '''
+        table, elevation_offset, moisture_offset = self.get_biome_table()
+        elevation_index = np.clip(np.asarray(elevation_levels) - elevation_offset, 0, table.shape[0] - 1)
+        moisture_index = np.clip(np.asarray(moisture_levels) - moisture_offset, 0, table.shape[1] - 1)
+        return table[elevation_index, moisture_index]
+
+    def get_biome_table(self):
+        ''' Compiles _biome_assignments and _biome_dict into a dense table of colors
+            indexed by (elevation level - elevation offset, moisture level - moisture offset).
+            The table has a border of the _biome_other color on every side, so levels
+            outside the assigned range can be clipped onto it.
+
+            Returns:
+                table (array<array<array<int>>>) : A read-only (E, M, 4) uint8 array of colors.
+                elevation_offset (int) : The elevation level of the first row.
+                moisture_offset (int) : The moisture level of the first column.
+        '''
+        if getattr(self, '_biome_table', None) is None:
+            levels = np.array(list(self._biome_assignments), dtype=int).reshape(-1, 2)
+            elevation_offset, moisture_offset = levels.min(axis=0) - 1
+            shape = levels.max(axis=0) - levels.min(axis=0) + 3
+
+            table = np.empty((shape[0], shape[1], 4), dtype=np.uint8)
+            table[:] = self._biome_dict[self._biome_other]
+            for (elevation_level, moisture_level), biome in self._biome_assignments.items():
+                table[elevation_level - elevation_offset, moisture_level - moisture_offset] = self._biome_dict[biome]
+            table.flags.writeable = False
+            self._biome_table = (table, int(elevation_offset), int(moisture_offset))
+        return self._biome_table
 
     def get_islands(self, nodes):
         island_array = []
         if self._islands_boolean:
-            island_total = random.randrange(self._min_island_number, self._max_island_number + 1)
+            generator = self.get_generator('islands')
+            island_total = int(generator.integers(self._min_island_number, self._max_island_number + 1))
             for i in range(island_total):
-                island_size = random.random()*(self._max_island_size - self._min_island_size) + self._min_island_size
-                island_array.append([nodes[random.randrange(len(nodes))], island_size])
+                island_size = generator.random()*(self._max_island_size - self._min_island_size) + self._min_island_size
+                island_array.append([nodes[int(generator.integers(len(nodes)))], island_size])
         return island_array
 
     def is_cloud(self, node):
@@ -131,6 +190,15 @@ class BodySetting(object):
             noise = ps.perlin(node, self._cloud_noise_width, 1, self._ch)
             return noise
 
+    def is_cloud_array(self, nodes):
+        if self._clouds_boolean:
+            return self.get_cloud_noise_array(nodes) > self._cloud_noise_cutoff
+        return np.zeros(len(nodes), dtype=bool)
+
+    def get_cloud_noise_array(self, nodes):
+        if self._clouds_boolean:
+            return ps.perlin_array(nodes, self._cloud_noise_width, 1, self._ch)
+
     def get_cloud_color(self):
         if self._clouds_boolean:
             return self._cloud_color
@@ -188,16 +256,14 @@ class IronPlanet(TerrestrialPlanet):
         self._attr = {'atmosphere': 0.1}
 
         #Terrain_noise_generation
-        self._large_noise_weight = 1
-        self._medium_noise_weight = 0.3
-        self._small_noise_weight = 0.1
-        self._large_noise_width = (1/4) * self._diameter
-        self._medium_noise_width = (1/8) * self._diameter
-        self._small_noise_width = (1/14) * self._diameter
+        #(width, weight) of each octave of terrain noise, largest first
+        self._noise_octaves = [((1/4) * self._diameter, 1),
+                               ((1/8) * self._diameter, 0.3),
+                               ((1/14) * self._diameter, 0.1)]
         self._max_height = 0.55*self._diameter
         self._min_height = 0.5*self._diameter
         self._height_range = self._max_height - self._min_height
-        self._amplitude = self._height_range/(0.5*self._diameter*(self._large_noise_weight + self._medium_noise_weight + self._small_noise_weight))
+        self._amplitude = self._height_range/(0.5*self._diameter*sum(weight for width, weight in self._noise_octaves))
 
         #Moisture_noise_generation
         self._moisture_noise_width = (1/4)*self._diameter
@@ -257,16 +323,14 @@ class IcePlanet(TerrestrialPlanet):
         self._attr = {'atmosphere': 0.12}
 
         #Terrain_noise_generation
-        self._large_noise_weight = 1
-        self._medium_noise_weight = 0.3
-        self._small_noise_weight = 0.1
-        self._large_noise_width = (1/4) * self._diameter
-        self._medium_noise_width = (1/8) * self._diameter
-        self._small_noise_width = (1/14) * self._diameter
+        #(width, weight) of each octave of terrain noise, largest first
+        self._noise_octaves = [((1/4) * self._diameter, 1),
+                               ((1/8) * self._diameter, 0.3),
+                               ((1/14) * self._diameter, 0.1)]
         self._max_height = 0.55*self._diameter
         self._min_height = 0.5*self._diameter
         self._height_range = self._max_height - self._min_height
-        self._amplitude = self._height_range/(0.5*self._diameter*(self._large_noise_weight + self._medium_noise_weight + self._small_noise_weight))
+        self._amplitude = self._height_range/(0.5*self._diameter*sum(weight for width, weight in self._noise_octaves))
 
         #Moisture_noise_generation
         self._moisture_noise_width = (1/2)*self._diameter
@@ -327,16 +391,14 @@ class EarthAnalog(TerrestrialPlanet):
         self._attr = {'atmosphere': 0.28}
 
         #Terrain_noise_generation
-        self._large_noise_weight = 1
-        self._medium_noise_weight = 0.3
-        self._small_noise_weight = 0.1
-        self._large_noise_width = (1/4) * self._diameter
-        self._medium_noise_width = (1/8) * self._diameter
-        self._small_noise_width = (1/14) * self._diameter
+        #(width, weight) of each octave of terrain noise, largest first
+        self._noise_octaves = [((1/4) * self._diameter, 1),
+                               ((1/8) * self._diameter, 0.3),
+                               ((1/14) * self._diameter, 0.1)]
         self._max_height = 0.55*self._diameter
         self._min_height = 0.5*self._diameter
         self._height_range = self._max_height - self._min_height
-        self._amplitude = self._height_range/(0.5*self._diameter*(self._large_noise_weight + self._medium_noise_weight + self._small_noise_weight))
+        self._amplitude = self._height_range/(0.5*self._diameter*sum(weight for width, weight in self._noise_octaves))
 
         #Moisture_noise_generation
         self._moisture_noise_width = (1/5)*self._diameter
@@ -435,16 +497,14 @@ class ClassicMoon(MoonSetting):
         self._min_island_size = (1/10) * self._diameter
 
         #Terrain_noise_generation
-        self._large_noise_weight = 1
-        self._medium_noise_weight = 0.4
-        self._small_noise_weight = 0.3
-        self._large_noise_width = (1/5) * self._diameter
-        self._medium_noise_width = (1/10) * self._diameter
-        self._small_noise_width = (1/20) * self._diameter
+        #(width, weight) of each octave of terrain noise, largest first
+        self._noise_octaves = [((1/5) * self._diameter, 1),
+                               ((1/10) * self._diameter, 0.4),
+                               ((1/20) * self._diameter, 0.3)]
         self._max_height = 0.51*self._diameter
         self._min_height = 0.5*self._diameter
         self._height_range = self._max_height - self._min_height
-        self._amplitude = self._height_range/(0.5*self._diameter*(self._large_noise_weight + self._medium_noise_weight + self._small_noise_weight))
+        self._amplitude = self._height_range/(0.5*self._diameter*sum(weight for width, weight in self._noise_octaves))
 
         #Moisture_noise_generation
         self._moisture_noise_width = (1/3)*self._diameter
@@ -1,5 +1,8 @@
 import planet_main as pm
+import planet_benchmark as pb
 
 
-pm.make_img(5)
+pm.make_img(5, seed='test')
 
+#Fails if the numpy rasterizer stops matching the pil one
+pb.check_rasterizers()